@@ -0,0 +1,136 @@
+"""
+Benchmark mémoire: pic de RSS par requête avec des images base64.
+
+Simule le chemin complet d'une requête /v1/messages contenant N images:
+parsing JSON du body → validation AnthropicRequest → conversion Azure →
+sérialisation du body amont en chunks (comme AzureOpenAIClient). Mesure le pic d'allocation
+Python (tracemalloc) et le pic de RSS de la requête.
+
+Chaque requête s'exécute dans un sous-process neuf qui relit le body
+depuis un fichier: ru_maxrss étant un maximum sur la vie du process, la
+différence avant / après la requête donne son propre pic de RSS.
+
+Usage:
+    python benchmarks/bench_image_memory.py --images 10 --image-mb 2
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://localhost")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "bench")
+
+from config import get_config  # noqa: E402
+from models.anthropic import AnthropicRequest  # noqa: E402
+from converters.request_converter import convert_anthropic_to_azure_request  # noqa: E402
+from services.azure_client import iter_body_chunks  # noqa: E402
+
+
+def _rss_mb() -> float:
+    """Pic de RSS du process en Mo (ru_maxrss est en Ko sous Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak / 1024
+
+
+def build_body(images: int, image_mb: float) -> bytes:
+    """Construit un body Anthropic avec des images dans un tool_result."""
+    raw = os.urandom(int(image_mb * 1024 * 1024))
+    data = base64.b64encode(raw).decode("ascii")
+    image_blocks = [
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}}
+        for _ in range(images)
+    ]
+    body = {
+        "model": "claude-sonnet-4-5-20250929",
+        "max_tokens": 1024,
+        "messages": [
+            {"role": "user", "content": "Take screenshots"},
+            {"role": "assistant", "content": [
+                {"type": "tool_use", "id": "toolu_01", "name": "screenshot", "input": {}}
+            ]},
+            {"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": "toolu_01", "content": image_blocks}
+            ]},
+        ]
+    }
+    return json.dumps(body).encode("utf-8")
+
+
+def run_request(body: bytes, config) -> int:
+    """Exécute le chemin d'une requête et retourne la taille du body amont."""
+    request = AnthropicRequest.model_validate(json.loads(body))
+    azure_request = convert_anthropic_to_azure_request(request, config)
+    # Body amont streamé par chunks, comme AzureOpenAIClient sans compression
+    return sum(len(chunk) for chunk in iter_body_chunks(azure_request))
+
+
+def measure_request(path: str) -> dict:
+    """Exécuté dans le sous-process: une requête, pics alloc et RSS."""
+    config = get_config()
+    with open(path, "rb") as f:
+        body = f.read()
+
+    rss_before = _rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    upstream_size = run_request(body, config)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "elapsed_ms": elapsed,
+        "upstream_bytes": upstream_size,
+        "alloc_peak_mb": peak / 1024 / 1024,
+        "rss_peak_mb": _rss_mb() - rss_before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--image-mb", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_request(args.child)))
+        return
+
+    body = build_body(args.images, args.image_mb)
+    body_mb = len(body) / 1024 / 1024
+    print(f"Body: {body_mb:.1f} MB ({args.images} x {args.image_mb} MB images)")
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+        f.write(body)
+        f.flush()
+        for i in range(args.requests):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", f.name],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            alloc_mb = result["alloc_peak_mb"]
+            rss_mb = result["rss_peak_mb"]
+            print(
+                f"Requête {i + 1}: {result['elapsed_ms']:.0f} ms, "
+                f"upstream {result['upstream_bytes'] / 1024 / 1024:.1f} MB, "
+                f"pic alloc {alloc_mb:.1f} MB ({alloc_mb / body_mb:.2f}x body), "
+                f"pic RSS +{rss_mb:.1f} MB ({rss_mb / body_mb:.2f}x body)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark: latence inter-tokens des petits streams pendant l'arrivée de
+grosses requêtes, avec et sans offload des conversions (OFFLOAD_MIN_SIZE).
+
+Le proxy est lancé dans un sous-process, face au faux upstream: les petits
+streams reçoivent un token toutes les --token-ms, pendant que des requêtes
+de --large-mb Mo arrivent toutes les --large-every-ms. Affiche les
+percentiles des intervalles entre tokens et le retard de l'event loop
+(/health).
+
+Usage:
+    python benchmarks/bench_loop_lag.py --large-mb 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_upstream import create_app, replay_marker  # noqa: E402
+from replay import ROOT, percentile, wait_ready  # noqa: E402
+
+
+def build_records(tokens: int, token_ms: float) -> List[Dict[str, Any]]:
+    """Enregistrements synthétiques: 0 = petit stream, 1 = réponse non-streaming."""
+    chunks = [
+        [i * token_ms, {"data": {"id": "c", "model": "g", "choices": [{"delta": {"content": "tok"}}]}}]
+        for i in range(tokens)
+    ]
+    chunks.append([tokens * token_ms, "data: [DONE]"])
+    return [
+        {"upstream": {"status": 200, "chunks": chunks}},
+        {"upstream": {"status": 200, "total_ms": 0, "body": {
+            "id": "c1", "model": "g",
+            "choices": [{"message": {"content": "ok"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1}
+        }}},
+    ]
+
+
+def build_large_request(size_mb: float) -> Dict[str, Any]:
+    """Historique agentique (texte, tool_use, tool_result) d'environ size_mb Mo."""
+    messages = []
+    turn = 0
+    while len(json.dumps(messages)) < size_mb * 1024 * 1024:
+        tool_id = f"toolu_{turn:06d}"
+        messages.append({"role": "user", "content": "lorem ipsum " * 150})
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": "Calling tool"},
+            {"type": "tool_use", "id": tool_id, "name": "read_file", "input": {
+                "path": f"/src/module_{turn}.py", "options": {"lines": list(range(100)), "follow": True}
+            }},
+        ]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": tool_id, "content": "def f():\n    return 1\n" * 60}
+        ]})
+        turn += 1
+    messages.append({"role": "user", "content": "continue"})
+    return {
+        "model": "claude-sonnet-4-5-20250929",
+        "max_tokens": 1024,
+        "system": replay_marker(1),
+        "messages": messages,
+    }
+
+
+async def small_stream(client: httpx.AsyncClient, url: str, gaps: List[float]):
+    body = {
+        "model": "claude-sonnet-4-5-20250929",
+        "max_tokens": 256,
+        "stream": True,
+        "system": replay_marker(0),
+        "messages": [{"role": "user", "content": "hi"}],
+    }
+    async with client.stream("POST", f"{url}/v1/messages", json=body) as response:
+        last = None
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or "text_delta" not in line:
+                continue
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append((now - last) * 1000)
+            last = now
+
+
+async def large_request(client: httpx.AsyncClient, url: str, body: bytes, delay: float, durations: List[float]):
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    response = await client.post(
+        f"{url}/v1/messages", content=body, headers={"Content-Type": "application/json"}
+    )
+    response.raise_for_status()
+    durations.append((time.perf_counter() - start) * 1000)
+
+
+async def run_mode(name: str, offload_min_size: int, args, upstream_url: str, large_body: bytes):
+    env = dict(
+        os.environ,
+        AZURE_OPENAI_ENDPOINT=upstream_url,
+        AZURE_OPENAI_API_KEY="bench",
+        OFFLOAD_MIN_SIZE=str(offload_min_size),
+    )
+    for key in ("RECORD_PATH", "USE_RESPONSES_API", "SESSIONS_ENABLED"):
+        env.pop(key, None)
+
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.proxy_port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    url = f"http://127.0.0.1:{args.proxy_port}"
+    try:
+        await wait_ready(url)
+        gaps: List[float] = []
+        durations: List[float] = []
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            await asyncio.gather(
+                *(small_stream(client, url, gaps) for _ in range(args.streams)),
+                *(
+                    large_request(client, url, large_body, 0.1 + i * args.large_every_ms / 1000, durations)
+                    for i in range(args.large)
+                ),
+            )
+            health = (await client.get(f"{url}/health")).json()
+
+        lag = health.get("event_loop_lag_ms", {})
+        print(
+            f"{name:11} inter-token p50={percentile(gaps, 50):6.1f} p99={percentile(gaps, 99):6.1f} "
+            f"max={max(gaps):6.1f} ms | large p50={percentile(durations, 50):6.0f} ms | "
+            f"loop lag p99={lag.get('p99', 0):6.1f} max={lag.get('max', 0):6.1f} ms"
+        )
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+async def main_async(args):
+    fake = uvicorn.Server(uvicorn.Config(
+        create_app(build_records(args.tokens, args.token_ms)),
+        host="127.0.0.1", port=args.upstream_port, log_level="warning"
+    ))
+    fake_task = asyncio.create_task(fake.serve())
+    while not fake.started:
+        await asyncio.sleep(0.05)
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+
+    large_body = json.dumps(build_large_request(args.large_mb)).encode("utf-8")
+    print(
+        f"{args.streams} streams x {args.tokens} tokens every {args.token_ms} ms, "
+        f"{args.large} requests of {len(large_body) / 1024 / 1024:.1f} MB every {args.large_every_ms} ms"
+    )
+
+    try:
+        await run_mode("no offload", 1 << 62, args, upstream_url, large_body)
+        await run_mode("offload", args.offload_min_size, args, upstream_url, large_body)
+    finally:
+        fake.should_exit = True
+        await fake_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--large", type=int, default=8)
+    parser.add_argument("--large-mb", type=float, default=5.0)
+    parser.add_argument("--large-every-ms", type=float, default=200.0)
+    parser.add_argument("--offload-min-size", type=int, default=1024 * 1024)
+    parser.add_argument("--proxy-port", type=int, default=8100)
+    parser.add_argument("--upstream-port", type=int, default=8101)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Faux upstream Azure OpenAI rejouant des réponses enregistrées (RECORD_PATH).
+
+Chaque requête reçue est associée à son enregistrement par le marqueur
+`[replay:N]` que le replayer place dans le system prompt. La réponse
+enregistrée est rejouée avec son timing d'origine (chunks de streaming à
+leur offset), divisé par `speed`.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import List, Dict, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse, StreamingResponse  # noqa: E402
+
+from utils.compression import decompress  # noqa: E402
+from utils.recorder import expand  # noqa: E402
+
+
+MARKER = re.compile(rb"\[replay:(\d+)\]")
+
+
+def replay_marker(index: int) -> str:
+    return f"[replay:{index}]"
+
+
+def create_app(records: List[Dict[str, Any]], speed: float = 1.0) -> FastAPI:
+    """Crée l'app du faux upstream pour une liste d'enregistrements."""
+    app = FastAPI(title="Fake Azure OpenAI upstream")
+
+    async def replay(request: Request):
+        start = time.perf_counter()
+        body = await request.body()
+        encoding = request.headers.get("content-encoding")
+        if encoding:
+            body = decompress(body, encoding, 1024 * 1024 * 1024)
+
+        match = MARKER.search(body)
+        if not match or int(match.group(1)) >= len(records):
+            return JSONResponse({"error": {"message": "No replay marker in request"}}, status_code=400)
+
+        upstream = records[int(match.group(1))]["upstream"]
+        status = upstream.get("status", 200)
+
+        if status != 200:
+            await asyncio.sleep(upstream.get("total_ms", 0) / 1000 / speed)
+            return JSONResponse({"error": {"message": "Replayed upstream error"}}, status_code=status or 500)
+
+        if "chunks" in upstream:
+            async def stream():
+                for offset_ms, item in upstream["chunks"]:
+                    delay = offset_ms / 1000 / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if isinstance(item, dict):
+                        yield f"data: {json.dumps(expand(item['data']))}\n\n"
+                    elif item.startswith("data: "):
+                        yield f"{item}\n\n"
+                    else:
+                        yield f"{item}\n"
+                if upstream.get("aborted"):
+                    # Stream coupé par le client d'origine: rester ouvert jusqu'à la coupure
+                    await asyncio.sleep(max(0.0, upstream["total_ms"] / 1000 / speed - (time.perf_counter() - start)))
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(upstream.get("total_ms", 0) / 1000 / speed)
+        return JSONResponse(expand(upstream.get("body", {})))
+
+    app.add_api_route("/openai/v1/chat/completions", replay, methods=["POST"])
+    app.add_api_route("/openai/v1/responses", replay, methods=["POST"])
+    return app
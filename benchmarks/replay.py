@@ -0,0 +1,235 @@
+"""
+Rejoue du trafic enregistré (RECORD_PATH) contre le proxy et un faux upstream.
+
+Les requêtes sont envoyées au rythme d'origine divisé par --speed; le faux
+upstream rejoue les réponses enregistrées avec leur timing divisé par
+--upstream-speed. Sans --proxy-url, le proxy est lancé dans un sous-process
+pointant vers le faux upstream.
+
+Les requêtes enregistrées en mode session sont rejouées dans l'ordre de
+chaque session, avec le x-session-prefix-hash renvoyé par le proxy.
+
+Usage:
+    python benchmarks/replay.py traffic.jsonl.2 traffic.jsonl.1 traffic.jsonl --speed 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any, Optional
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_upstream import create_app, replay_marker  # noqa: E402
+from utils.recorder import expand  # noqa: E402
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_records(paths: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Charge les enregistrements, triés par heure d'arrivée."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def build_request(record: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """Reconstruit le body de la requête avec le marqueur de replay."""
+    body = expand(record["request"])
+    system = body.get("system")
+    body["system"] = f"{replay_marker(index)} {system}" if isinstance(system, str) else replay_marker(index)
+    return body
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def send(
+    client: httpx.AsyncClient,
+    url: str,
+    record: Dict[str, Any],
+    index: int,
+    delay: float,
+    speed: float,
+    results: list,
+    sessions: Optional[Dict[str, Any]] = None
+):
+    await asyncio.sleep(delay)
+    # Body pleine taille reconstruit au moment de l'envoi seulement
+    body = build_request(record, index)
+    session = record.get("session")
+    upstream = record["upstream"]
+    # Requête coupée par le client d'origine: couper au même moment
+    abort_after = upstream.get("total_ms", 0) / 1000 / speed if upstream.get("aborted") else None
+
+    if not session:
+        await _send(client, url, body, {}, results, abort_after)
+        return
+
+    # Tours d'une même session envoyés dans l'ordre, avec le hash renvoyé par le proxy
+    state = sessions.setdefault(session["id"], {"lock": asyncio.Lock(), "hash": ""})
+    async with state["lock"]:
+        headers = {"x-session-id": session["id"]}
+        if session.get("delta"):
+            headers["x-session-prefix-hash"] = state["hash"]
+        response_headers = await _send(client, url, body, headers, results, abort_after)
+        state["hash"] = response_headers.get("x-session-prefix-hash", "")
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    url: str,
+    body: Dict[str, Any],
+    headers: Dict[str, str],
+    results: list,
+    abort_after: Optional[float] = None
+) -> httpx.Headers:
+    start = time.perf_counter()
+    result = {"stream": body.get("stream", False), "gaps": [], "status": 0}
+    response_headers = httpx.Headers()
+
+    async def consume():
+        nonlocal response_headers
+        async with client.stream("POST", f"{url}/v1/messages", json=body, headers=headers) as response:
+            result["status"] = response.status_code
+            response_headers = response.headers
+            last = None
+            async for chunk in response.aiter_raw():
+                now = time.perf_counter()
+                if last is None:
+                    result["ttfb_ms"] = (now - start) * 1000
+                else:
+                    result["gaps"].append((now - last) * 1000)
+                last = now
+
+    try:
+        await asyncio.wait_for(consume(), abort_after)
+    except asyncio.TimeoutError:
+        result["aborted"] = True
+    except httpx.HTTPError as e:
+        result["status"] = 0
+        result["error"] = str(e)
+
+    result["total_ms"] = (time.perf_counter() - start) * 1000
+    results.append(result)
+    return response_headers
+
+
+def report(results: List[Dict[str, Any]], elapsed: float):
+    # Les requêtes coupées comme à l'enregistrement sont exclues des percentiles
+    aborted = [r for r in results if r.get("aborted")]
+    ok = [r for r in results if r["status"] == 200 and not r.get("aborted")]
+    errors = len(results) - len(ok) - len(aborted)
+    print(f"Requests: {len(results)} in {elapsed:.1f}s, errors: {errors}, aborted (as recorded): {len(aborted)}")
+
+    for name, values in (
+        ("TTFB (ms)", [r["ttfb_ms"] for r in ok if "ttfb_ms" in r]),
+        ("Total (ms)", [r["total_ms"] for r in ok]),
+        ("Inter-chunk (ms)", [g for r in ok if r["stream"] for g in r["gaps"]]),
+    ):
+        if values:
+            print(
+                f"{name:18} p50={percentile(values, 50):8.1f} p90={percentile(values, 90):8.1f} "
+                f"p99={percentile(values, 99):8.1f} max={max(values):8.1f} mean={statistics.mean(values):8.1f}"
+            )
+
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    async with httpx.AsyncClient() as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Proxy not ready at {url}")
+
+
+async def main_async(args):
+    records = load_records(args.records, args.limit)
+    if not records:
+        print("No records")
+        return
+
+    # Faux upstream dans ce process (I/O uniquement)
+    fake = uvicorn.Server(uvicorn.Config(
+        create_app(records, args.upstream_speed), host="127.0.0.1", port=args.upstream_port, log_level="warning"
+    ))
+    fake_task = asyncio.create_task(fake.serve())
+    while not fake.started:
+        await asyncio.sleep(0.05)
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+
+    proxy = None
+    proxy_url = args.proxy_url
+    if not proxy_url:
+        env = dict(
+            os.environ,
+            AZURE_OPENAI_ENDPOINT=upstream_url,
+            AZURE_OPENAI_API_KEY="replay",
+            USE_RESPONSES_API=str(records[0].get("backend") == "responses").lower(),
+            SESSIONS_ENABLED=str(any(r.get("session") for r in records)).lower(),
+        )
+        env.pop("RECORD_PATH", None)
+        proxy = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.proxy_port), "--log-level", "warning"],
+            cwd=ROOT, env=env
+        )
+        proxy_url = f"http://127.0.0.1:{args.proxy_port}"
+    else:
+        print(f"Proxy must use AZURE_OPENAI_ENDPOINT={upstream_url}")
+
+    try:
+        await wait_ready(proxy_url)
+        ts0 = records[0]["ts"]
+        results: List[Dict[str, Any]] = []
+        sessions: Dict[str, Any] = {}
+
+        start = time.perf_counter()
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            await asyncio.gather(*(
+                send(client, proxy_url, r, i, (r["ts"] - ts0) / args.speed, args.speed, results, sessions)
+                for i, r in enumerate(records)
+            ))
+        report(results, time.perf_counter() - start)
+    finally:
+        if proxy:
+            proxy.terminate()
+            proxy.wait()
+        fake.should_exit = True
+        await fake_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("records", nargs="+", help="Fichiers d'enregistrement (RECORD_PATH et rotations)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Facteur d'accélération du rythme d'arrivée")
+    parser.add_argument("--upstream-speed", type=float, default=1.0, help="Facteur d'accélération de l'upstream")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--proxy-url", default=None, help="Proxy déjà lancé (sinon lancé en sous-process)")
+    parser.add_argument("--proxy-port", type=int, default=8100)
+    parser.add_argument("--upstream-port", type=int, default=8101)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import json
-from typing import Dict
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -15,6 +15,31 @@ class Config(BaseSettings):
         },
         alias="MODEL_MAPPING"
     )
+    # Backend Responses API: n'envoie que les nouveaux messages (previous_response_id)
+    use_responses_api: bool = Field(default=False, alias="USE_RESPONSES_API")
+    response_chain_max_entries: int = Field(default=10000, alias="RESPONSE_CHAIN_MAX_ENTRIES")
+    # Compression: bodies entrants (Content-Encoding), amont et réponses
+    max_request_body_size: int = Field(default=200 * 1024 * 1024, alias="MAX_REQUEST_BODY_SIZE")
+    upstream_compression: Optional[str] = Field(default=None, alias="UPSTREAM_COMPRESSION")
+    upstream_compression_min_size: int = Field(default=64 * 1024, alias="UPSTREAM_COMPRESSION_MIN_SIZE")
+    response_compression: bool = Field(default=True, alias="RESPONSE_COMPRESSION")
+    response_compression_min_size: int = Field(default=1024, alias="RESPONSE_COMPRESSION_MIN_SIZE")
+    compression_offload_min_size: int = Field(default=256 * 1024, alias="COMPRESSION_OFFLOAD_MIN_SIZE")
+    # Token des endpoints /admin (désactivés si absent)
+    admin_token: Optional[str] = Field(default=None, alias="ADMIN_TOKEN")
+    # Enregistrement du trafic pour le replay (désactivé si absent)
+    record_path: Optional[str] = Field(default=None, alias="RECORD_PATH")
+    record_max_bytes: int = Field(default=100 * 1024 * 1024, alias="RECORD_MAX_BYTES")
+    record_backup_count: int = Field(default=5, alias="RECORD_BACKUP_COUNT")
+    record_queue_size: int = Field(default=64, alias="RECORD_QUEUE_SIZE")
+    # Sessions: le client n'envoie que les nouveaux messages (header x-session-id)
+    sessions_enabled: bool = Field(default=False, alias="SESSIONS_ENABLED")
+    session_max_count: int = Field(default=1000, alias="SESSION_MAX_COUNT")
+    session_max_bytes: int = Field(default=1024 * 1024 * 1024, alias="SESSION_MAX_BYTES")
+    session_ttl: int = Field(default=3600, alias="SESSION_TTL")
+    # Offload des conversions / (dé)sérialisations des grosses requêtes vers un pool de threads
+    offload_min_size: int = Field(default=1024 * 1024, alias="OFFLOAD_MIN_SIZE")
+    offload_workers: int = Field(default=4, alias="OFFLOAD_WORKERS")
     timeout: int = Field(default=120)
     debug: bool = Field(default=False)
 
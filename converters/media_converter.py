@@ -0,0 +1,112 @@
+import json
+from typing import Dict, Any, Optional, List, Tuple
+
+
+# Types de blocks Anthropic transportant un média (image, PDF, ...)
+MEDIA_BLOCK_TYPES = ("image", "document")
+
+
+def source_to_data_url(source: Dict[str, Any]) -> Optional[str]:
+    """
+    Construit l'URL à transmettre en amont depuis une source Anthropic.
+
+    Les données base64 ne sont ni décodées ni re-validées, mais le préfixe
+    `data:` exigé par OpenAI impose une copie complète de la chaîne. Le body
+    amont étant streamé par content part (services/azure_client.py), une
+    requête alloue au pic environ 2.4x son body (voir
+    benchmarks/bench_image_memory.py).
+    """
+    source_type = source.get("type")
+
+    if source_type == "base64":
+        media_type = source.get("media_type", "application/octet-stream")
+        return f"data:{media_type};base64,{source.get('data', '')}"
+
+    if source_type == "url":
+        return source.get("url")
+
+    return None
+
+
+def image_block_to_openai(block: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convertit un block image Anthropic vers un content part OpenAI.
+
+    Anthropic:
+    {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "..."}}
+
+    OpenAI:
+    {"type": "image_url", "image_url": {"url": "data:image/png;base64,..."}}
+    """
+    url = source_to_data_url(block.get("source") or {})
+    if not url:
+        return None
+
+    return {
+        "type": "image_url",
+        "image_url": {"url": url}
+    }
+
+
+def document_block_to_openai(block: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convertit un block document Anthropic vers un content part OpenAI.
+
+    - source base64 (PDF) → part "file" avec file_data en data URL
+    - source text → part "text"
+    - source url → part "text" référençant l'URL (non supporté en amont)
+    """
+    source = block.get("source") or {}
+    source_type = source.get("type")
+    title = block.get("title")
+
+    if source_type == "base64":
+        return {
+            "type": "file",
+            "file": {
+                "filename": title or "document.pdf",
+                "file_data": source_to_data_url(source)
+            }
+        }
+
+    if source_type == "text":
+        text = source.get("data", "")
+        if title:
+            text = f"{title}\n\n{text}"
+        return {"type": "text", "text": text}
+
+    if source_type == "url":
+        return {"type": "text", "text": f"[Document: {source.get('url', '')}]"}
+
+    return None
+
+
+def media_block_to_openai(block: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convertit un block image ou document vers un content part OpenAI."""
+    if block.get("type") == "image":
+        return image_block_to_openai(block)
+    if block.get("type") == "document":
+        return document_block_to_openai(block)
+    return None
+
+
+def split_tool_result_content(tr_content: Any) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Sépare le contenu d'un tool_result en (texte, blocks médias).
+
+    Les résultats de tool OpenAI n'acceptent que du texte: les images et
+    documents sont renvoyés à part pour être transmis dans un message user.
+    """
+    if isinstance(tr_content, str):
+        return tr_content, []
+
+    if isinstance(tr_content, list):
+        media = [b for b in tr_content if isinstance(b, dict) and b.get("type") in MEDIA_BLOCK_TYPES]
+        if media:
+            texts = [
+                b.get("text", "") for b in tr_content
+                if isinstance(b, dict) and b.get("type") == "text"
+            ]
+            return "\n".join(texts), media
+
+    return json.dumps(tr_content), []
@@ -1,5 +1,26 @@
 import json
 from typing import List, Dict, Any, Optional
+from converters.media_converter import (
+    MEDIA_BLOCK_TYPES,
+    media_block_to_openai,
+    split_tool_result_content
+)
+
+
+def _user_content_parts(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Construit les content parts OpenAI d'un message user (texte + médias)
+    en conservant l'ordre des blocks ("capture A: [img] capture B: [img]").
+    """
+    parts = []
+    for block in blocks:
+        if block.get("type") == "text":
+            parts.append({"type": "text", "text": block.get("text", "")})
+            continue
+        part = media_block_to_openai(block)
+        if part:
+            parts.append(part)
+    return parts
 
 
 def anthropic_messages_to_openai(
@@ -13,6 +34,7 @@ def anthropic_messages_to_openai(
     - system prompt séparé → message system
     - tool_use content blocks → assistant message avec tool_calls
     - tool_result content blocks → tool message
+    - image / document content blocks → content parts image_url / file
     """
     openai_messages = []
 
@@ -44,6 +66,12 @@ def anthropic_messages_to_openai(
             tool_uses = [b for b in content if isinstance(b, dict) and b.get("type") == "tool_use"]
             tool_results = [b for b in content if isinstance(b, dict) and b.get("type") == "tool_result"]
             text_blocks = [b for b in content if isinstance(b, dict) and b.get("type") == "text"]
+            media_blocks = [b for b in content if isinstance(b, dict) and b.get("type") in MEDIA_BLOCK_TYPES]
+            # Texte et médias dans l'ordre d'origine
+            user_blocks = [
+                b for b in content
+                if isinstance(b, dict) and (b.get("type") == "text" or b.get("type") in MEDIA_BLOCK_TYPES)
+            ]
 
             # Assistant message avec tool calls
             if tool_uses and role == "assistant":
@@ -73,14 +101,16 @@ def anthropic_messages_to_openai(
 
             # Tool results → tool messages
             elif tool_results and role == "user":
+                # Médias issus des tool results (ex: screenshots), transmis
+                # dans un message user après les messages tool
+                result_media = []
                 for tr in tool_results:
                     # Convert ID: toolu_ABC → call_ABC
                     openai_id = tr["tool_use_id"].replace("toolu_", "call_", 1)
 
                     # Get content as string
-                    tr_content = tr.get("content", "")
-                    if not isinstance(tr_content, str):
-                        tr_content = json.dumps(tr_content)
+                    tr_content, tr_media = split_tool_result_content(tr.get("content", ""))
+                    result_media.extend(tr_media)
 
                     openai_messages.append({
                         "role": "tool",
@@ -88,6 +118,19 @@ def anthropic_messages_to_openai(
                         "content": tr_content
                     })
 
+                if result_media or media_blocks:
+                    openai_messages.append({
+                        "role": "user",
+                        "content": _user_content_parts(result_media + user_blocks)
+                    })
+
+            # User message avec images / documents
+            elif media_blocks and role == "user":
+                openai_messages.append({
+                    "role": "user",
+                    "content": _user_content_parts(user_blocks)
+                })
+
             # Regular text message
             elif text_blocks:
                 text_content = " ".join([b.get("text", "") for b in text_blocks])
@@ -1,16 +1,40 @@
-from typing import Dict, Any
-from models.anthropic import AnthropicRequest
+from typing import Dict, Any, Union, List, Optional
+from pydantic import BaseModel
+from models.anthropic import AnthropicRequest, AnthropicMessage
 from converters.messages_converter import anthropic_messages_to_openai
 from converters.tools_converter import anthropic_tool_to_openai
 from config import Config
 
 
+def message_to_dict(msg: Union[AnthropicMessage, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Convertit un message Pydantic en dict sans passer par model_dump.
+
+    model_dump sérialise les unions de content en essayant chaque variante,
+    ce qui calcule le repr des valeurs (dont les payloads base64 de
+    plusieurs Mo). Les blocks n'ont pas de modèles imbriqués: une copie
+    superficielle suffit et les chaînes sont partagées, pas copiées.
+    """
+    if not isinstance(msg, BaseModel):
+        return msg
+
+    content = msg.content
+    if isinstance(content, list):
+        content = [dict(b) if isinstance(b, BaseModel) else b for b in content]
+
+    return {"role": msg.role, "content": content}
+
+
 def convert_anthropic_to_azure_request(
     anthropic_request: AnthropicRequest,
-    config: Config
+    config: Config,
+    openai_messages: Optional[List[Dict[str, Any]]] = None
 ) -> Dict[str, Any]:
     """
     Convertit une requête Anthropic complète vers format Azure OpenAI.
+
+    openai_messages permet de fournir des messages déjà convertis (mode
+    session); le system prompt est alors ajouté en tête.
     """
     # 1. Mapper le modèle Claude → Azure deployment
     model = anthropic_request.model
@@ -18,17 +42,14 @@ def convert_anthropic_to_azure_request(
 
     # 2. Convertir les messages
     # Extraire la liste de messages (peut être des objets Pydantic ou des dicts)
-    messages_list = []
-    for msg in anthropic_request.messages:
-        if hasattr(msg, "model_dump"):
-            messages_list.append(msg.model_dump())
-        else:
-            messages_list.append(msg)
-
-    openai_messages = anthropic_messages_to_openai(
-        messages_list,
-        anthropic_request.system
-    )
+    if openai_messages is None:
+        messages_list = [message_to_dict(msg) for msg in anthropic_request.messages]
+        openai_messages = anthropic_messages_to_openai(
+            messages_list,
+            anthropic_request.system
+        )
+    elif anthropic_request.system:
+        openai_messages = [{"role": "system", "content": anthropic_request.system}] + openai_messages
 
     # 3. Convertir les tools
     openai_tools = None
@@ -0,0 +1,362 @@
+import json
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable
+from models.anthropic import AnthropicRequest
+from converters.media_converter import (
+    MEDIA_BLOCK_TYPES,
+    source_to_data_url,
+    split_tool_result_content
+)
+from config import Config
+from utils.logging import logger
+
+
+# Mapper raison d'arrêt Responses → stop_reason Anthropic
+INCOMPLETE_REASON_MAP = {
+    "max_output_tokens": "max_tokens",
+    "content_filter": "stop_sequence"
+}
+
+
+def _media_block_to_responses(block: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convertit un block image / document Anthropic vers un content part Responses.
+
+    - image → input_image (data URL, base64 non décodé)
+    - document base64 → input_file
+    - document text → input_text
+    """
+    source = block.get("source") or {}
+
+    if block.get("type") == "image":
+        url = source_to_data_url(source)
+        return {"type": "input_image", "image_url": url} if url else None
+
+    if source.get("type") == "base64":
+        return {
+            "type": "input_file",
+            "filename": block.get("title") or "document.pdf",
+            "file_data": source_to_data_url(source)
+        }
+
+    if source.get("type") == "text":
+        return {"type": "input_text", "text": source.get("data", "")}
+
+    if source.get("type") == "url":
+        return {"type": "input_text", "text": f"[Document: {source.get('url', '')}]"}
+
+    return None
+
+
+def anthropic_messages_to_responses_input(
+    anthropic_messages: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Convertit les messages Anthropic vers les input items de l'API Responses.
+
+    Gère:
+    - text → input_text (user) / output_text (assistant)
+    - tool_use → item function_call
+    - tool_result → item function_call_output
+    - image / document → input_image / input_file
+    """
+    items = []
+
+    for msg in anthropic_messages:
+        role = msg.get("role")
+        content = msg.get("content")
+
+        if role not in ["user", "assistant"]:
+            continue
+
+        if isinstance(content, str):
+            items.append({"role": role, "content": content})
+            continue
+
+        if not isinstance(content, list):
+            continue
+
+        text_type = "output_text" if role == "assistant" else "input_text"
+        parts = []
+        # Médias issus des tool results, ajoutés après les function_call_output
+        result_media = []
+
+        def flush_parts():
+            if parts:
+                items.append({"role": role, "content": list(parts)})
+                parts.clear()
+
+        for block in content:
+            if not isinstance(block, dict):
+                continue
+            block_type = block.get("type")
+
+            if block_type == "text":
+                parts.append({"type": text_type, "text": block.get("text", "")})
+
+            elif block_type in MEDIA_BLOCK_TYPES and role == "user":
+                part = _media_block_to_responses(block)
+                if part:
+                    parts.append(part)
+
+            elif block_type == "tool_use" and role == "assistant":
+                flush_parts()
+                items.append({
+                    "type": "function_call",
+                    # Convert ID: toolu_ABC → call_ABC
+                    "call_id": block["id"].replace("toolu_", "call_", 1),
+                    "name": block["name"],
+                    "arguments": json.dumps(block["input"])
+                })
+
+            elif block_type == "tool_result" and role == "user":
+                flush_parts()
+                output, media = split_tool_result_content(block.get("content", ""))
+                result_media.extend(media)
+                items.append({
+                    "type": "function_call_output",
+                    "call_id": block["tool_use_id"].replace("toolu_", "call_", 1),
+                    "output": output
+                })
+
+        flush_parts()
+
+        if result_media:
+            media_parts = [_media_block_to_responses(b) for b in result_media]
+            items.append({"role": "user", "content": [p for p in media_parts if p]})
+
+    return items
+
+
+def convert_anthropic_to_responses_request(
+    anthropic_request: AnthropicRequest,
+    config: Config,
+    messages_list: List[Dict[str, Any]],
+    previous_response_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Convertit une requête Anthropic vers format Azure Responses API.
+
+    messages_list ne contient que les messages à envoyer: la conversation
+    entière, ou seulement les nouveaux messages si previous_response_id
+    référence la réponse qui couvre le début de la conversation.
+    """
+    azure_deployment = config.model_mapping.get(anthropic_request.model, "gpt-4o-mini")
+
+    responses_request = {
+        "model": azure_deployment,
+        "input": anthropic_messages_to_responses_input(messages_list),
+        "max_output_tokens": anthropic_request.max_tokens,
+        "stream": anthropic_request.stream,
+        # Nécessaire pour pouvoir chaîner le tour suivant
+        "store": True,
+    }
+
+    if previous_response_id:
+        responses_request["previous_response_id"] = previous_response_id
+
+    # instructions n'est pas hérité de previous_response_id: toujours renvoyé
+    if anthropic_request.system:
+        responses_request["instructions"] = anthropic_request.system
+
+    if anthropic_request.temperature is not None:
+        responses_request["temperature"] = anthropic_request.temperature
+
+    if anthropic_request.top_p is not None:
+        responses_request["top_p"] = anthropic_request.top_p
+
+    if anthropic_request.tools:
+        tools = []
+        for tool in anthropic_request.tools:
+            tool_dict = tool.model_dump() if hasattr(tool, "model_dump") else tool
+            tools.append({
+                "type": "function",
+                "name": tool_dict.get("name"),
+                "description": tool_dict.get("description", ""),
+                "parameters": tool_dict.get("input_schema", {})
+            })
+        responses_request["tools"] = tools
+        responses_request["tool_choice"] = "auto"
+
+    if anthropic_request.stop_sequences:
+        logger.warning("stop_sequences not supported by the Responses API, ignored")
+
+    return responses_request
+
+
+def _stop_reason(response: Dict[str, Any], has_tool_calls: bool) -> str:
+    """Détermine le stop_reason Anthropic d'une réponse Responses."""
+    if response.get("status") == "incomplete":
+        reason = (response.get("incomplete_details") or {}).get("reason")
+        return INCOMPLETE_REASON_MAP.get(reason, "end_turn")
+    if has_tool_calls:
+        return "tool_use"
+    return "end_turn"
+
+
+def convert_responses_to_anthropic_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convertit une réponse Azure Responses API vers format Anthropic.
+    """
+    content = []
+    has_tool_calls = False
+
+    for item in response.get("output", []):
+        item_type = item.get("type")
+
+        if item_type == "message":
+            for part in item.get("content", []):
+                if part.get("type") == "output_text" and part.get("text"):
+                    content.append({"type": "text", "text": part["text"]})
+
+        elif item_type == "function_call":
+            has_tool_calls = True
+            try:
+                input_dict = json.loads(item["arguments"]) if item.get("arguments") else {}
+            except json.JSONDecodeError:
+                input_dict = {}
+            content.append({
+                "type": "tool_use",
+                # Convert ID format: call_ABC → toolu_ABC
+                "id": item["call_id"].replace("call_", "toolu_", 1),
+                "name": item["name"],
+                "input": input_dict
+            })
+
+    usage = response.get("usage") or {}
+
+    return {
+        "id": f"msg_{response['id']}",
+        "type": "message",
+        "role": "assistant",
+        "content": content,
+        "model": response.get("model", "unknown"),
+        "stop_reason": _stop_reason(response, has_tool_calls),
+        "usage": {
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0)
+        }
+    }
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Formate un événement SSE Anthropic."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def convert_responses_stream_to_anthropic(
+    responses_stream: AsyncIterator[str],
+    on_complete: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> AsyncIterator[str]:
+    """
+    Convertit le stream d'événements Responses API vers format Anthropic SSE.
+
+    Responses format:
+    event: response.output_text.delta
+    data: {"type":"response.output_text.delta","output_index":0,"delta":"Hello"}
+
+    Chaque output item (message, function_call) devient un content block
+    Anthropic. on_complete reçoit la réponse finale (response.completed),
+    utilisée pour enregistrer le response_id de la conversation.
+    """
+    # output_index Responses → index du content block Anthropic
+    block_indexes: Dict[int, int] = {}
+    has_tool_calls = False
+
+    async for line in responses_stream:
+        if not line.startswith("data: "):
+            continue
+
+        try:
+            event = json.loads(line[6:])
+        except json.JSONDecodeError:
+            # Skip malformed events
+            continue
+
+        event_type = event.get("type")
+
+        if event_type == "response.created":
+            response = event.get("response", {})
+            yield _sse("message_start", {
+                "type": "message_start",
+                "message": {
+                    "id": f"msg_{response.get('id', 'unknown')}",
+                    "type": "message",
+                    "role": "assistant",
+                    "content": [],
+                    "model": response.get("model", "unknown"),
+                    "usage": {"input_tokens": 0, "output_tokens": 0}
+                }
+            })
+
+        elif event_type == "response.output_item.added":
+            item = event.get("item", {})
+            if item.get("type") == "message":
+                content_block = {"type": "text", "text": ""}
+            elif item.get("type") == "function_call":
+                has_tool_calls = True
+                content_block = {
+                    "type": "tool_use",
+                    "id": item.get("call_id", "").replace("call_", "toolu_", 1),
+                    "name": item.get("name", ""),
+                    "input": {}
+                }
+            else:
+                # reasoning, etc.: pas d'équivalent Anthropic
+                continue
+
+            index = len(block_indexes)
+            block_indexes[event.get("output_index", index)] = index
+            yield _sse("content_block_start", {
+                "type": "content_block_start",
+                "index": index,
+                "content_block": content_block
+            })
+
+        elif event_type == "response.output_text.delta":
+            index = block_indexes.get(event.get("output_index"))
+            if index is not None and event.get("delta"):
+                yield _sse("content_block_delta", {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {"type": "text_delta", "text": event["delta"]}
+                })
+
+        elif event_type == "response.function_call_arguments.delta":
+            index = block_indexes.get(event.get("output_index"))
+            if index is not None and event.get("delta"):
+                yield _sse("content_block_delta", {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {"type": "input_json_delta", "partial_json": event["delta"]}
+                })
+
+        elif event_type == "response.output_item.done":
+            index = block_indexes.get(event.get("output_index"))
+            if index is not None:
+                yield _sse("content_block_stop", {"type": "content_block_stop", "index": index})
+
+        elif event_type in ("response.completed", "response.incomplete"):
+            response = event.get("response", {})
+            usage = response.get("usage") or {}
+
+            yield _sse("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": _stop_reason(response, has_tool_calls)},
+                "usage": {"output_tokens": usage.get("output_tokens", 0)}
+            })
+            yield _sse("message_stop", {"type": "message_stop"})
+
+            if on_complete:
+                on_complete(response)
+            break
+
+        elif event_type in ("response.failed", "error"):
+            error = event.get("error") or (event.get("response") or {}).get("error") or {}
+            yield _sse("error", {
+                "type": "error",
+                "error": {
+                    "type": "api_error",
+                    "message": f"Azure API error: {error.get('message', 'response failed')}"
+                }
+            })
+            break
@@ -1,34 +1,64 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Header, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+import secrets
 import httpx
 from contextlib import asynccontextmanager
 
 from models.anthropic import AnthropicRequest
-from converters.request_converter import convert_anthropic_to_azure_request
+from converters.request_converter import convert_anthropic_to_azure_request, message_to_dict
+from converters.messages_converter import anthropic_messages_to_openai
 from converters.response_converter import convert_azure_to_anthropic_response
 from converters.streaming_converter import convert_openai_stream_to_anthropic
+from converters.responses_converter import (
+    convert_anthropic_to_responses_request,
+    convert_responses_to_anthropic_response,
+    convert_responses_stream_to_anthropic
+)
 from services.azure_client import AzureOpenAIClient
+from services.session_store import (
+    ConversationSession, SessionStore, SessionResyncRequired, chain_hashes, retained_size
+)
 from config import get_config
+from utils.compression import DecompressingRoute, compressed_json_response
 from utils.logging import logger
+from utils.message_hash import extend_hash
+from utils.profiling import profiler, ProfileSettings
+from utils.recorder import recorder
+from utils import offload
+from utils.offload import run_cpu, loop_lag
 
 
 # Global Azure client
 azure_client = None
+# Sessions de conversation (SESSIONS_ENABLED)
+session_store = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifespan."""
-    global azure_client
+    global azure_client, session_store
     config = get_config()
     azure_client = AzureOpenAIClient(config)
+    if config.sessions_enabled:
+        session_store = SessionStore(config.session_max_count, config.session_max_bytes, config.session_ttl)
     logger.info("Proxy server started")
     logger.info(f"Azure endpoint: {config.azure_openai_endpoint}")
     logger.info(f"Model mapping: {config.model_mapping}")
+    if config.use_responses_api:
+        logger.info("Backend: Azure Responses API (previous_response_id)")
+    if config.record_path:
+        recorder.open(
+            config.record_path, config.record_max_bytes, config.record_backup_count, config.record_queue_size
+        )
+    loop_lag.start()
     yield
     # Cleanup
+    await loop_lag.stop()
     if azure_client:
         await azure_client.close()
+    recorder.close()
+    offload.shutdown()
     logger.info("Proxy server stopped")
 
 
@@ -38,10 +68,205 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan
 )
+# Décoder les bodies gzip / zstd (Content-Encoding) avant parsing
+app.router.route_class = DecompressingRoute
+
+
+async def handle_chat_completions_request(
+    request: AnthropicRequest, config, accept_encoding: str = None, session=None, size: int = 0
+):
+    """
+    Traite une requête via le backend Azure Chat Completions.
+
+    size (octets de la requête) envoie les conversions des grosses requêtes
+    dans le pool d'offload.
+    """
+    # 1. Convert Anthropic request → Azure request
+    # En mode session, les messages déjà convertis aux tours précédents sont réutilisés
+    openai_messages = list(session.openai_messages) if session else None
+    azure_request = await run_cpu(size, convert_anthropic_to_azure_request, request, config, openai_messages)
+
+    # 2. Call Azure OpenAI
+    if request.stream:
+        # Streaming response
+        logger.info("Processing streaming request")
+        openai_stream = recorder.record_stream(azure_client.chat_completion_stream(azure_request, size))
+        openai_stream = profiler.time_upstream(openai_stream)
+        anthropic_stream = profiler.profile_stream(convert_openai_stream_to_anthropic(openai_stream))
+
+        return StreamingResponse(
+            anthropic_stream,
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+
+    # Non-streaming response
+    logger.info("Processing non-streaming request")
+    azure_response = await profiler.time_upstream_call(
+        recorder.record_call(azure_client.chat_completion(azure_request, size))
+    )
+
+    # 3. Convert Azure response → Anthropic response
+    # Taille estimée de la réponse: ~4 octets par token généré
+    response_size = azure_response.get("usage", {}).get("completion_tokens", 0) * 4
+    anthropic_response = await run_cpu(response_size, convert_azure_to_anthropic_response, azure_response)
+
+    logger.info(f"Response ID: {anthropic_response['id']}, Stop reason: {anthropic_response['stop_reason']}")
+
+    return await compressed_json_response(anthropic_response, accept_encoding)
+
+
+async def handle_responses_request(
+    request: AnthropicRequest, config, accept_encoding: str = None, session=None, size: int = 0
+):
+    """
+    Traite une requête via le backend Azure Responses API.
+
+    Seuls les messages ajoutés depuis la dernière réponse connue sont
+    envoyés, avec previous_response_id. Si le préfixe diverge ou n'est pas
+    connu, la conversation complète est envoyée. En mode session, la
+    dernière réponse est retrouvée par la session (hash déjà calculé à
+    l'ajout des messages) au lieu de re-hasher le transcript.
+    """
+    chain = azure_client.response_chain
+    messages_list = [message_to_dict(msg) for msg in request.messages]
+    seed = config.model_mapping.get(request.model, "gpt-4o-mini")
+    request_hash = session.prefix_hash if session else None
+
+    def prepare():
+        # Hash de tout le transcript + conversion: hors event loop pour les grosses requêtes
+        if session is not None:
+            previous_response_id = session.response_id if session.response_seed == seed else None
+            start = session.response_start if previous_response_id else 0
+            hashes = None
+        else:
+            previous_response_id, start, hashes = chain.lookup(messages_list, seed)
+        responses_request = convert_anthropic_to_responses_request(
+            request, config, messages_list[start:], previous_response_id
+        )
+        return previous_response_id, start, hashes, responses_request
+
+    previous_response_id, start, hashes, responses_request = await run_cpu(size, prepare)
+    if previous_response_id:
+        logger.info(f"Sending {len(messages_list) - start}/{len(messages_list)} messages with previous_response_id")
+
+    def fallback():
+        return convert_anthropic_to_responses_request(request, config, messages_list)
+
+    def record_response(assistant_message, response_id):
+        if session is not None:
+            session.set_response(extend_hash(request_hash, assistant_message), response_id, seed)
+        else:
+            chain.record(hashes, assistant_message, response_id)
+
+    def record(response):
+        anthropic_response = convert_responses_to_anthropic_response(response)
+        assistant_message = {"role": "assistant", "content": anthropic_response["content"]}
+        record_response(assistant_message, response["id"])
+
+    if request.stream:
+        logger.info("Processing streaming request (Responses API)")
+        responses_stream = recorder.record_stream(azure_client.responses_stream(responses_request, fallback, size))
+        responses_stream = profiler.time_upstream(responses_stream)
+        anthropic_stream = profiler.profile_stream(
+            convert_responses_stream_to_anthropic(responses_stream, on_complete=record)
+        )
+
+        return StreamingResponse(
+            anthropic_stream,
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+
+    logger.info("Processing non-streaming request (Responses API)")
+    response = await profiler.time_upstream_call(
+        recorder.record_call(azure_client.responses(responses_request, fallback, size))
+    )
+
+    response_size = (response.get("usage") or {}).get("output_tokens", 0) * 4
+    anthropic_response = await run_cpu(response_size, convert_responses_to_anthropic_response, response)
+    assistant_message = {"role": "assistant", "content": anthropic_response["content"]}
+    record_response(assistant_message, response["id"])
+    logger.info(f"Response ID: {anthropic_response['id']}, Stop reason: {anthropic_response['stop_reason']}")
+
+    return await compressed_json_response(anthropic_response, accept_encoding)
+
+
+def prepare_session_turn(request_messages, base_hash: str, convert: bool):
+    """
+    Conversion et hash des messages d'un tour de session, sans toucher à
+    la session (exécuté hors event loop pour les gros transcripts).
+    Retourne les messages, leur conversion Chat Completions, leurs hashes
+    chaînés depuis base_hash et la taille des chaînes créées par la conversion.
+    """
+    messages = [message_to_dict(msg) for msg in request_messages]
+    openai_messages = anthropic_messages_to_openai(messages) if convert else []
+    return messages, openai_messages, chain_hashes(base_hash, messages), retained_size(openai_messages, messages)
+
+
+async def apply_session(
+    request: AnthropicRequest, session_id: str, prefix_hash: str, body_size: int, convert: bool = True
+):
+    """
+    Applique une requête en mode session.
+
+    Sans prefix_hash, la requête porte tout le transcript et remplace la
+    session. Avec prefix_hash, elle ne porte que les messages ajoutés depuis
+    le tour correspondant; system et tools absents sont repris de la session.
+    convert garde aussi la conversion Chat Completions des messages (inutile
+    avec le backend Responses API). La taille comptée est celle du body
+    plus les chaînes créées par la conversion (data URLs...).
+
+    La conversion et le hash passent par run_cpu; seule la mise à jour du
+    store reste sur l'event loop. Si la session a changé entre-temps
+    (requête concurrente, éviction), un resync est demandé.
+    Retourne la requête complète reconstruite et la session.
+    """
+    if prefix_hash is None:
+        session = None
+        base_hash = ConversationSession().prefix_hash
+    else:
+        session = session_store.get(session_id)
+        if session is None:
+            raise SessionResyncRequired("Session unknown or expired")
+        if session.prefix_hash != prefix_hash and not session_store.rewind(session, prefix_hash):
+            raise SessionResyncRequired("Session prefix hash mismatch")
+        base_hash = session.prefix_hash
+
+    messages, openai_messages, hashes, converted_size = await run_cpu(
+        body_size, prepare_session_turn, request.messages, base_hash, convert
+    )
+
+    if session is None:
+        session = session_store.reset(session_id)
+    elif session_store.get(session_id) is not session or session.prefix_hash != base_hash:
+        raise SessionResyncRequired("Session modified by a concurrent request")
+
+    size_before = session.size
+    session.append(messages, openai_messages, body_size + converted_size, hashes)
+
+    if prefix_hash is None or request.system is not None:
+        session.system = request.system
+    if prefix_hash is None or request.tools is not None:
+        session.tools = request.tools
+    session_store.account(session, session.size - size_before)
+
+    full_request = request.model_copy(update={
+        "messages": list(session.messages),
+        "system": session.system,
+        "tools": session.tools,
+    })
+    return full_request, session
 
 
 @app.post("/v1/messages")
-async def messages_endpoint(request: AnthropicRequest):
+async def messages_endpoint(request: AnthropicRequest, http_request: Request):
     """
     Endpoint compatible with Anthropic Messages API.
     Converts requests to Azure OpenAI format and responses back to Anthropic format.
@@ -52,35 +277,55 @@ async def messages_endpoint(request: AnthropicRequest):
         logger.info(f"Received request for model: {request.model}")
         logger.info(f"Stream: {request.stream}, Max tokens: {request.max_tokens}")
 
-        # 1. Convert Anthropic request → Azure request
-        azure_request = convert_anthropic_to_azure_request(request, config)
-
-        # 2. Call Azure OpenAI
-        if request.stream:
-            # Streaming response
-            logger.info("Processing streaming request")
-            openai_stream = azure_client.chat_completion_stream(azure_request)
-            anthropic_stream = convert_openai_stream_to_anthropic(openai_stream)
-
-            return StreamingResponse(
-                anthropic_stream,
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                }
+        accept_encoding = http_request.headers.get("accept-encoding")
+
+        handler = handle_responses_request if config.use_responses_api else handle_chat_completions_request
+
+        # Mode session: le client n'envoie que les messages ajoutés depuis le dernier tour
+        session = None
+        session_id = http_request.headers.get("x-session-id")
+        prefix_hash = http_request.headers.get("x-session-prefix-hash")
+        # Taille de la requête (body décodé), pour l'offload des conversions
+        size = len(await http_request.body())
+        if session_store is not None and session_id:
+            request, session = await apply_session(
+                request, session_id, prefix_hash, size, convert=not config.use_responses_api
+            )
+            size = session.size
+            session_hash = session.prefix_hash
+            logger.info(f"Session {session_id}: {len(request.messages)} messages, prefix {'delta' if prefix_hash else 'full'}")
+
+        # Enregistrement du trafic (RECORD_PATH): le body JSON est déjà parsé et mis en cache
+        if recorder.enabled:
+            session_info = {"id": session_id, "delta": prefix_hash is not None} if session else None
+            recorder.start(
+                await http_request.json(), "responses" if config.use_responses_api else "chat", session_info
             )
-        else:
-            # Non-streaming response
-            logger.info("Processing non-streaming request")
-            azure_response = await azure_client.chat_completion(azure_request)
 
-            # 3. Convert Azure response → Anthropic response
-            anthropic_response = convert_azure_to_anthropic_response(azure_response)
+        # Requête échantillonnée pour le profiling (POST /admin/profile)
+        if profiler.active and profiler.sample_request():
+            response = await profiler.profile_call(handler(request, config, accept_encoding, session, size))
+        else:
+            response = await handler(request, config, accept_encoding, session, size)
 
-            logger.info(f"Response ID: {anthropic_response['id']}, Stop reason: {anthropic_response['stop_reason']}")
+        if session:
+            # Hash du transcript à renvoyer au prochain tour dans x-session-prefix-hash
+            response.headers["x-session-prefix-hash"] = session_hash
+        return response
 
-            return JSONResponse(content=anthropic_response)
+    except SessionResyncRequired as e:
+        logger.info(f"Session resync required: {e}")
+        return JSONResponse(
+            content={
+                "type": "error",
+                "error": {
+                    "type": "invalid_request_error",
+                    "message": f"{e}, resend the full conversation without x-session-prefix-hash"
+                }
+            },
+            status_code=409,
+            headers={"x-session-resync": "required"}
+        )
 
     except httpx.HTTPStatusError as e:
         logger.error(f"Azure API error: {e.response.status_code} - {e.response.text}")
@@ -112,13 +357,58 @@ async def messages_endpoint(request: AnthropicRequest):
         )
 
 
+def require_admin(x_admin_token: str = Header(default="")):
+    """Restreint les endpoints /admin au porteur de ADMIN_TOKEN."""
+    config = get_config()
+    if not config.admin_token:
+        raise HTTPException(status_code=404, detail="Admin endpoints disabled")
+    if not secrets.compare_digest(x_admin_token, config.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(settings: ProfileSettings):
+    """Démarre une session de profiling (fenêtre de temps, fraction de requêtes)."""
+    try:
+        profiler.start(settings)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profile():
+    """Arrête la session de profiling en cours."""
+    profiler.stop()
+    return profiler.status()
+
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_status():
+    """État de la session de profiling."""
+    return profiler.status()
+
+
+@app.get("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu():
+    """Piles CPU échantillonnées, format folded (flamegraph.pl, speedscope)."""
+    return PlainTextResponse(profiler.folded_cpu())
+
+
+@app.get("/admin/profile/allocations", dependencies=[Depends(require_admin)])
+async def profile_allocations():
+    """Allocations tracemalloc en fin de session (octets), format folded."""
+    return PlainTextResponse(profiler.folded_allocations())
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint."""
     return {
         "status": "healthy",
         "proxy": "claude-code-router-to-azure",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "event_loop_lag_ms": loop_lag.stats()
     }
 
 
@@ -20,12 +20,24 @@ class ToolResultBlock(BaseModel):
     content: Union[str, List[Dict[str, Any]]]
 
 
-ContentBlock = Union[TextBlock, ToolUseBlock, ToolResultBlock]
+class ImageBlock(BaseModel):
+    type: Literal["image"] = "image"
+    # Source gardée en dict: les données base64 ne sont ni décodées ni copiées
+    source: Dict[str, Any]
+
+
+class DocumentBlock(BaseModel):
+    type: Literal["document"] = "document"
+    source: Dict[str, Any]
+    title: Optional[str] = None
+
+
+ContentBlock = Union[TextBlock, ToolUseBlock, ToolResultBlock, ImageBlock, DocumentBlock]
 
 
 class AnthropicMessage(BaseModel):
     role: Literal["user", "assistant"]
-    content: Union[str, List[Union[TextBlock, ToolUseBlock, ToolResultBlock]]]
+    content: Union[str, List[ContentBlock]]
 
 
 class AnthropicTool(BaseModel):
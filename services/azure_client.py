@@ -1,7 +1,74 @@
+import json
 import httpx
-from typing import Dict, Any, AsyncIterator
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, Optional, Tuple, Union
 from config import Config
+from services.response_chain import ResponseChainStore
+from utils.compression import compress, run_sized, supported_encodings
 from utils.logging import logger
+from utils.offload import run_cpu
+
+
+# Même sérialisation que httpx (json=...), encodeur C en un seul appel
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode
+
+# Taille visée des chunks du body amont streamé
+BODY_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_json(value: Any, depth: int = 4) -> Iterator[str]:
+    """
+    Sérialise value en morceaux: les dicts / listes sont découpés jusqu'à
+    depth niveaux (requête → messages → message → content parts), le reste
+    est encodé par l'encodeur C. Une image base64 n'est ainsi copiée en JSON
+    que le temps de son propre chunk, jamais avec tout le body.
+    """
+    if depth == 0 or not isinstance(value, (dict, list)) or not value:
+        yield _encode_json(value)
+        return
+
+    if isinstance(value, dict):
+        separator = "{"
+        for key, item in value.items():
+            yield f"{separator}{_encode_json(key)}:"
+            yield from iter_json(item, depth - 1)
+            separator = ","
+        yield "}"
+    else:
+        separator = "["
+        for item in value:
+            yield separator
+            yield from iter_json(item, depth - 1)
+            separator = ","
+        yield "]"
+
+
+def next_body_chunk(pieces: Iterator[str]) -> bytes:
+    """Avance iter_json jusqu'à ~BODY_CHUNK_SIZE caractères et encode le lot."""
+    batch = []
+    size = 0
+    for piece in pieces:
+        batch.append(piece)
+        size += len(piece)
+        if size >= BODY_CHUNK_SIZE:
+            break
+    return "".join(batch).encode("utf-8")
+
+
+def iter_body_chunks(request: Dict[str, Any]) -> Iterator[bytes]:
+    """Body JSON de la requête amont en chunks de bytes (version synchrone)."""
+    pieces = iter_json(request)
+    while True:
+        chunk = next_body_chunk(pieces)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _is_previous_response_error(error: httpx.HTTPStatusError) -> bool:
+    """Vrai si Azure rejette le previous_response_id (expiré, inconnu...)."""
+    if error.response.status_code not in (400, 404):
+        return False
+    return "previous_response" in error.response.text
 
 
 class AzureOpenAIClient:
@@ -10,6 +77,12 @@ class AzureOpenAIClient:
     def __init__(self, config: Config):
         self.config = config
         self.client = httpx.AsyncClient(timeout=config.timeout)
+        if config.upstream_compression and config.upstream_compression not in supported_encodings():
+            raise ValueError(f"Unsupported UPSTREAM_COMPRESSION: {config.upstream_compression}")
+        # Backend Responses API: préfixes de conversation → response_id
+        self.response_chain = None
+        if config.use_responses_api:
+            self.response_chain = ResponseChainStore(config.response_chain_max_entries)
 
     def _build_url(self, operation: str = "chat/completions") -> str:
         """Construire l'URL complète pour Azure OpenAI."""
@@ -24,7 +97,47 @@ class AzureOpenAIClient:
             "api-key": self.config.azure_openai_api_key
         }
 
-    async def chat_completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _serialize(request: Dict[str, Any]) -> bytes:
+        return _encode_json(request).encode("utf-8")
+
+    async def _stream_body(self, request: Dict[str, Any], size_hint: int) -> AsyncIterator[bytes]:
+        # Chaque lot est encodé dans le pool d'offload pour les grosses requêtes
+        pieces = iter_json(request)
+        while True:
+            chunk = await run_cpu(size_hint, next_body_chunk, pieces)
+            if not chunk:
+                return
+            yield chunk
+
+    async def _prepare_body(
+        self, request: Dict[str, Any], size_hint: int = 0
+    ) -> Tuple[Union[bytes, AsyncIterator[bytes]], Dict[str, str]]:
+        """
+        Préparer le body amont.
+
+        Sans UPSTREAM_COMPRESSION, le body est streamé en chunks de bytes
+        (transfer-encoding chunked): ni le JSON complet en str ni sa copie
+        en bytes ne sont construits. Avec compression, le body est
+        sérialisé en entier puis compressé s'il dépasse
+        UPSTREAM_COMPRESSION_MIN_SIZE.
+
+        size_hint (taille de la requête entrante) envoie la sérialisation
+        des grosses requêtes dans le pool d'offload.
+        """
+        headers = self._get_headers()
+        encoding = self.config.upstream_compression
+        if not encoding:
+            return self._stream_body(request, size_hint), headers
+
+        body = await run_cpu(size_hint, self._serialize, request)
+        if len(body) >= self.config.upstream_compression_min_size:
+            body = await run_sized(compress, body, encoding)
+            headers["Content-Encoding"] = encoding
+
+        return body, headers
+
+    async def chat_completion(self, request: Dict[str, Any], size_hint: int = 0) -> Dict[str, Any]:
         """
         Envoyer une requête non-streaming à Azure OpenAI.
         """
@@ -34,14 +147,15 @@ class AzureOpenAIClient:
             logger.debug(f"Azure request URL: {url}")
             logger.debug(f"Azure request body: {request}")
 
+        body, headers = await self._prepare_body(request, size_hint)
         response = await self.client.post(
             url,
-            json=request,
-            headers=self._get_headers()
+            content=body,
+            headers=headers
         )
 
         response.raise_for_status()
-        result = response.json()
+        result = await run_cpu(len(response.content), json.loads, response.content)
 
         if self.config.debug:
             logger.debug(f"Azure response: {result}")
@@ -49,7 +163,7 @@ class AzureOpenAIClient:
         return result
 
     async def chat_completion_stream(
-        self, request: Dict[str, Any]
+        self, request: Dict[str, Any], size_hint: int = 0
     ) -> AsyncIterator[str]:
         """
         Envoyer une requête streaming à Azure OpenAI.
@@ -61,12 +175,96 @@ class AzureOpenAIClient:
             logger.debug(f"Azure streaming request URL: {url}")
             logger.debug(f"Azure streaming request body: {request}")
 
+        body, headers = await self._prepare_body(request, size_hint)
+        async with self.client.stream(
+            "POST",
+            url,
+            content=body,
+            headers=headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if self.config.debug and line.strip():
+                    logger.debug(f"Azure stream line: {line}")
+                yield line
+
+    async def responses(
+        self,
+        request: Dict[str, Any],
+        fallback: Optional[Callable[[], Dict[str, Any]]] = None,
+        size_hint: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Envoyer une requête non-streaming à l'API Responses.
+
+        Si la requête utilise previous_response_id et qu'Azure ne le
+        reconnaît plus, la requête complète construite par fallback est
+        renvoyée.
+        """
+        url = self._build_url("responses")
+
+        if self.config.debug:
+            logger.debug(f"Azure responses request URL: {url}")
+            logger.debug(f"Azure responses request body: {request}")
+
+        body, headers = await self._prepare_body(request, size_hint)
+        response = await self.client.post(
+            url,
+            content=body,
+            headers=headers
+        )
+
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            if not (fallback and request.get("previous_response_id") and _is_previous_response_error(e)):
+                raise
+            logger.warning("previous_response_id rejected, resending full conversation")
+            return await self.responses(fallback(), size_hint=size_hint)
+
+        result = await run_cpu(len(response.content), json.loads, response.content)
+
+        if self.config.debug:
+            logger.debug(f"Azure responses response: {result}")
+
+        return result
+
+    async def responses_stream(
+        self,
+        request: Dict[str, Any],
+        fallback: Optional[Callable[[], Dict[str, Any]]] = None,
+        size_hint: int = 0
+    ) -> AsyncIterator[str]:
+        """
+        Envoyer une requête streaming à l'API Responses.
+        Retourne un iterator de lignes SSE.
+        """
+        url = self._build_url("responses")
+
+        if self.config.debug:
+            logger.debug(f"Azure responses streaming request URL: {url}")
+            logger.debug(f"Azure responses streaming request body: {request}")
+
+        body, headers = await self._prepare_body(request, size_hint)
         async with self.client.stream(
             "POST",
             url,
-            json=request,
-            headers=self._get_headers()
+            content=body,
+            headers=headers
         ) as response:
+            if response.is_error and fallback and request.get("previous_response_id"):
+                await response.aread()
+                error = httpx.HTTPStatusError(
+                    f"Azure responses error {response.status_code}",
+                    request=response.request,
+                    response=response
+                )
+                if _is_previous_response_error(error):
+                    logger.warning("previous_response_id rejected, resending full conversation")
+                    async for line in self.responses_stream(fallback(), size_hint=size_hint):
+                        yield line
+                    return
+
             response.raise_for_status()
             async for line in response.aiter_lines():
                 if self.config.debug and line.strip():
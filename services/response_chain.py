@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from utils.message_hash import prefix_hashes, extend_hash
+
+
+class ResponseChainStore:
+    """
+    Associe des préfixes de conversation Anthropic aux response_id Azure.
+
+    Après chaque réponse, le hash du préfixe (messages envoyés + réponse
+    assistant) est enregistré avec le response_id. Au tour suivant, le plus
+    long préfixe connu permet de n'envoyer que les nouveaux messages avec
+    previous_response_id. Le store est borné (LRU).
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(
+        self, messages: List[Dict[str, Any]], seed: str = ""
+    ) -> Tuple[Optional[str], int, List[str]]:
+        """
+        Cherche le plus long préfixe connu de la conversation.
+
+        Retourne (previous_response_id, nombre de messages couverts, hashes).
+        Si aucun préfixe ne correspond, previous_response_id vaut None et
+        toute la conversation doit être envoyée.
+        """
+        hashes = prefix_hashes(messages, seed)
+
+        with self._lock:
+            # Au moins un message doit rester à envoyer
+            for k in range(len(messages) - 1, 0, -1):
+                response_id = self._entries.get(hashes[k])
+                if response_id:
+                    self._entries.move_to_end(hashes[k])
+                    return response_id, k, hashes
+
+        return None, 0, hashes
+
+    def record(
+        self, hashes: List[str], assistant_message: Dict[str, Any], response_id: str
+    ) -> None:
+        """Enregistre la conversation prolongée de la réponse assistant."""
+        key = extend_hash(hashes[-1], assistant_message)
+
+        with self._lock:
+            self._entries[key] = response_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,192 @@
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from utils.message_hash import prefix_hashes, extend_hash
+
+
+class SessionResyncRequired(Exception):
+    """Session inconnue, expirée ou divergente: le client doit renvoyer tout le transcript."""
+
+
+class ConversationSession:
+    """
+    État d'une conversation côté proxy.
+
+    Garde les messages Anthropic reçus, leur conversion OpenAI (sans le
+    system prompt, backend Chat Completions uniquement) et le hash chaîné
+    du transcript. L'état du tour précédent est conservé pour accepter le
+    renvoi d'un tour échoué.
+
+    Backend Responses API: response_id est la dernière réponse dont le
+    transcript (requête + réponse) a été retrouvé dans la session; elle
+    couvre messages[:response_start].
+    """
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+        self.openai_messages: List[Dict[str, Any]] = []
+        self.prefix_hash = prefix_hashes([])[0]
+        self.system: Optional[str] = None
+        self.tools: Optional[List[Any]] = None
+        self.size = 0
+        self.last_used = time.monotonic()
+        self.response_id: Optional[str] = None
+        self.response_seed: Optional[str] = None
+        self.response_start = 0
+        # Réponse en attente: (hash du transcript qu'elle termine, response_id, seed)
+        self._response_anchor: Optional[Tuple[str, str, str]] = None
+        # Tour précédent: (nb messages, nb messages OpenAI, hash, taille, réponse)
+        self._previous = None
+
+    def append(
+        self,
+        messages: List[Dict[str, Any]],
+        openai_messages: List[Dict[str, Any]],
+        size: int,
+        hashes: Optional[List[str]] = None
+    ) -> None:
+        """
+        Ajoute les messages d'un tour et met à jour le hash du transcript.
+
+        hashes (optionnel) sont les hashes chaînés déjà calculés depuis
+        prefix_hash, un par message (voir chain_hashes).
+        """
+        self._previous = (
+            len(self.messages), len(self.openai_messages), self.prefix_hash, self.size,
+            (self.response_id, self.response_seed, self.response_start)
+        )
+        if hashes is None:
+            hashes = chain_hashes(self.prefix_hash, messages)
+        for i, message_hash in enumerate(hashes):
+            self.prefix_hash = message_hash
+            # Le client renvoie la réponse précédente telle quelle: elle est réutilisable
+            if self._response_anchor and self._response_anchor[0] == self.prefix_hash:
+                _, self.response_id, self.response_seed = self._response_anchor
+                self.response_start = len(self.messages) + i + 1
+        self.messages.extend(messages)
+        self.openai_messages.extend(openai_messages)
+        self.size += size
+
+    def rewind(self, prefix_hash: str) -> bool:
+        """
+        Revient à l'état d'avant le dernier tour si prefix_hash le désigne
+        (le client renvoie un tour dont la réponse a échoué).
+        """
+        if not self._previous or self._previous[2] != prefix_hash:
+            return False
+        length, openai_length, self.prefix_hash, self.size, response = self._previous
+        self.response_id, self.response_seed, self.response_start = response
+        del self.messages[length:]
+        del self.openai_messages[openai_length:]
+        self._previous = None
+        return True
+
+    def set_response(self, prefix_hash: str, response_id: str, seed: str) -> None:
+        """
+        Enregistre la réponse Responses API d'un tour. prefix_hash est le
+        hash du transcript de la requête prolongé du message assistant.
+        """
+        self._response_anchor = (prefix_hash, response_id, seed)
+
+
+def chain_hashes(prefix_hash: str, messages: List[Dict[str, Any]]) -> List[str]:
+    """Hashes chaînés de prefix_hash prolongé de chaque message."""
+    hashes = []
+    for message in messages:
+        prefix_hash = extend_hash(prefix_hash, message)
+        hashes.append(prefix_hash)
+    return hashes
+
+
+def retained_size(converted: Any, source: Any) -> int:
+    """
+    Taille des chaînes de converted qui ne sont pas partagées avec source
+    (data URLs, arguments JSON re-sérialisés...): mémoire gardée en plus
+    des messages reçus.
+    """
+    shared = set()
+    stack = [source]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            shared.add(id(value))
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+    size = 0
+    stack = [converted]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            if id(value) not in shared:
+                size += len(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return size
+
+
+class SessionStore:
+    """
+    Store borné des sessions de conversation (SESSION_MAX_COUNT,
+    SESSION_MAX_BYTES), avec éviction LRU et expiration (SESSION_TTL).
+    """
+
+    def __init__(self, max_count: int, max_bytes: int, ttl: float):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_size = 0
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        """Retourne la session si elle existe et n'a pas expiré."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+
+        if time.monotonic() - session.last_used > self.ttl:
+            self.remove(session_id)
+            return None
+
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def reset(self, session_id: str) -> ConversationSession:
+        """Remplace la session par une session vide (renvoi complet du transcript)."""
+        self.remove(session_id)
+        session = ConversationSession()
+        self._sessions[session_id] = session
+        return session
+
+    def rewind(self, session: ConversationSession, prefix_hash: str) -> bool:
+        """Rejoue ConversationSession.rewind en décomptant la taille du tour annulé."""
+        size_before = session.size
+        if not session.rewind(prefix_hash):
+            return False
+        self.total_size += session.size - size_before
+        return True
+
+    def remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.total_size -= session.size
+
+    def account(self, session: ConversationSession, size_delta: int) -> None:
+        """Comptabilise la variation de taille d'une session et évince si nécessaire."""
+        self.total_size += size_delta
+        while self._sessions and (
+            len(self._sessions) > self.max_count or self.total_size > self.max_bytes
+        ):
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            # Ne jamais évincer la session en cours d'utilisation
+            if oldest is session:
+                break
+            self.remove(oldest_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
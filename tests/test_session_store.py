@@ -0,0 +1,205 @@
+import pytest
+
+from services import session_store as session_store_module
+from services.session_store import ConversationSession, SessionStore, chain_hashes, retained_size
+from utils.message_hash import prefix_hashes, extend_hash
+
+
+def _turn(text):
+    """Un tour user / assistant et sa conversion OpenAI."""
+    messages = [
+        {"role": "user", "content": text},
+        {"role": "assistant", "content": f"re: {text}"},
+    ]
+    return messages, [dict(m) for m in messages]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(session_store_module.time, "monotonic", fake)
+    return fake
+
+
+def test_append_extends_transcript_and_hash():
+    session = ConversationSession()
+    first, first_openai = _turn("a")
+    second, second_openai = _turn("b")
+
+    session.append(first, first_openai, 100)
+    session.append(second, second_openai, 50)
+
+    assert session.messages == first + second
+    assert session.openai_messages == first_openai + second_openai
+    assert session.prefix_hash == prefix_hashes(first + second)[-1]
+    assert session.size == 150
+
+
+def test_rewind_restores_previous_turn():
+    session = ConversationSession()
+    first, first_openai = _turn("a")
+    session.append(first, first_openai, 100)
+    hash_after_first = session.prefix_hash
+    session.append(*_turn("b"), 50)
+
+    assert session.rewind(hash_after_first)
+    assert session.messages == first
+    assert session.openai_messages == first_openai
+    assert session.prefix_hash == hash_after_first
+    assert session.size == 100
+    # Un seul tour peut être annulé
+    assert not session.rewind(prefix_hashes([])[0])
+
+
+def test_rewind_rejects_unknown_hash():
+    session = ConversationSession()
+    session.append(*_turn("a"), 100)
+
+    assert not session.rewind("0" * 64)
+    assert len(session.messages) == 2
+    assert session.size == 100
+
+
+def test_get_expires_after_ttl(clock):
+    store = SessionStore(max_count=10, max_bytes=10_000, ttl=60)
+    session = store.reset("s1")
+    session.append(*_turn("a"), 100)
+    store.account(session, 100)
+
+    clock.now += 59
+    assert store.get("s1") is session
+
+    # get() prolonge la session
+    clock.now += 59
+    assert store.get("s1") is session
+
+    clock.now += 61
+    assert store.get("s1") is None
+    assert len(store) == 0
+    assert store.total_size == 0
+
+
+def test_byte_bound_evicts_least_recently_used():
+    store = SessionStore(max_count=10, max_bytes=250, ttl=3600)
+    for session_id in ("s1", "s2"):
+        session = store.reset(session_id)
+        session.append(*_turn(session_id), 100)
+        store.account(session, 100)
+
+    # s1 redevient la plus récente: s2 est évincée en premier
+    store.get("s1")
+    session = store.reset("s3")
+    session.append(*_turn("s3"), 100)
+    store.account(session, 100)
+
+    assert store.get("s2") is None
+    assert store.get("s1") is not None
+    assert store.get("s3") is session
+    assert store.total_size == 200
+
+
+def test_byte_bound_never_evicts_current_session():
+    store = SessionStore(max_count=10, max_bytes=100, ttl=3600)
+    session = store.reset("s1")
+    session.append(*_turn("a"), 500)
+    store.account(session, 500)
+
+    assert store.get("s1") is session
+    assert store.total_size == 500
+
+
+def test_count_bound_evicts_oldest():
+    store = SessionStore(max_count=2, max_bytes=10_000, ttl=3600)
+    for session_id in ("s1", "s2", "s3"):
+        session = store.reset(session_id)
+        store.account(session, 0)
+
+    assert len(store) == 2
+    assert store.get("s1") is None
+
+
+def test_retried_turn_is_not_counted_twice():
+    store = SessionStore(max_count=10, max_bytes=1_000_000, ttl=3600)
+    session = store.reset("s1")
+    session.append(*_turn("a"), 100)
+    store.account(session, 100)
+    hash_after_first = session.prefix_hash
+
+    for _ in range(5):
+        if session.prefix_hash != hash_after_first:
+            assert store.rewind(session, hash_after_first)
+        size_before = session.size
+        session.append(*_turn("b"), 1000)
+        store.account(session, session.size - size_before)
+
+    assert session.size == 1100
+    assert store.total_size == 1100
+
+    store.remove("s1")
+    assert store.total_size == 0
+
+
+def test_response_is_reused_when_client_resends_it():
+    session = ConversationSession()
+    request = [{"role": "user", "content": "a"}]
+    session.append(request, [], 10)
+    assistant = {"role": "assistant", "content": "re: a"}
+    session.set_response(extend_hash(session.prefix_hash, assistant), "resp_1", "gpt")
+
+    # Réponse différente de celle enregistrée: pas de previous_response_id
+    session.append([{"role": "assistant", "content": "autre"}], [], 10)
+    assert session.response_id is None
+
+    assert session.rewind(prefix_hashes(request)[-1])
+    session.append([assistant, {"role": "user", "content": "b"}], [], 10)
+    assert session.response_id == "resp_1"
+    assert session.response_seed == "gpt"
+    assert session.response_start == 2
+
+
+def test_rewind_restores_previous_response():
+    session = ConversationSession()
+    session.append([{"role": "user", "content": "a"}], [], 10)
+    assistant = {"role": "assistant", "content": "re: a"}
+    session.set_response(extend_hash(session.prefix_hash, assistant), "resp_1", "gpt")
+    session.append([assistant, {"role": "user", "content": "b"}], [], 10)
+    hash_before_retry = session.prefix_hash
+
+    session.set_response(extend_hash(session.prefix_hash, assistant), "resp_2", "gpt")
+    session.append([assistant], [], 10)
+    assert session.response_id == "resp_2"
+
+    assert session.rewind(hash_before_retry)
+    assert session.response_id == "resp_1"
+    assert session.response_start == 2
+
+
+def test_retained_size_counts_only_new_strings():
+    text = "x" * 100
+    source = [{"role": "user", "content": text}]
+    data_url = "data:image/png;base64," + "A" * 50
+
+    # Chaînes reprises de source (même objet): non comptées
+    assert retained_size([{"role": "user", "content": text}], source) == 0
+    assert retained_size([{"role": "user", "content": [text, data_url]}], source) == len(data_url)
+
+
+def test_append_accepts_precomputed_hashes():
+    first, first_openai = _turn("a")
+    reference = ConversationSession()
+    reference.append(first, first_openai, 100)
+
+    session = ConversationSession()
+    hashes = chain_hashes(session.prefix_hash, first)
+    session.append(first, first_openai, 100, hashes)
+
+    assert hashes == prefix_hashes(first)[1:]
+    assert session.prefix_hash == reference.prefix_hash
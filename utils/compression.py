@@ -0,0 +1,214 @@
+import gzip
+import io
+import json
+import zlib
+from typing import Optional, Callable, Tuple, Dict, Any
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+from config import get_config
+from utils.offload import run_cpu, run_in_pool
+
+try:
+    import zstandard
+except ImportError:  # zstd optionnel: pip install zstandard
+    zstandard = None
+
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class UnsupportedEncodingError(ValueError):
+    """Content-Encoding inconnu ou non disponible (zstandard absent)."""
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Encodages supportés, par ordre de préférence."""
+    if zstandard is not None:
+        return ("zstd", "gzip")
+    return ("gzip",)
+
+
+def decompress(data: bytes, encoding: str, max_size: int) -> bytes:
+    """
+    Décompresse un body gzip / deflate / zstd.
+
+    La taille décompressée est bornée par max_size (protection contre les
+    archives explosives). Lève UnsupportedEncodingError si l'encodage est
+    inconnu, ValueError si le body est invalide ou trop gros.
+    """
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        result = _decompress_zlib(data, encoding, max_size)
+
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncodingError("zstd encoding requires the zstandard package")
+        try:
+            result = _decompress_zstd(data, max_size)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Invalid zstd body: {e}")
+
+    else:
+        raise UnsupportedEncodingError(f"Unsupported Content-Encoding: {encoding}")
+
+    return result
+
+
+def _decompress_zlib(data: bytes, encoding: str, max_size: int) -> bytes:
+    """Décode tous les membres d'un body gzip / zlib (gzip multi-membres)."""
+    chunks = []
+    total = 0
+    while True:
+        # wbits 47: détection automatique des en-têtes gzip / zlib
+        decompressor = zlib.decompressobj(wbits=47)
+        try:
+            chunk = decompressor.decompress(data, max_size + 1 - total)
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body: {e}")
+
+        total += len(chunk)
+        if total > max_size:
+            raise ValueError(f"Decompressed body exceeds {max_size} bytes")
+        if not decompressor.eof:
+            raise ValueError(f"Truncated {encoding} body")
+
+        chunks.append(chunk)
+        data = decompressor.unused_data
+        if not data:
+            return b"".join(chunks)
+
+
+def _decompress_zstd(data: bytes, max_size: int) -> bytes:
+    """
+    Décode toutes les frames d'un body zstd.
+
+    decompressobj ne borne pas sa sortie: une première passe en streaming
+    vérifie la taille décodée (sans la garder) avant de décoder frame par
+    frame en rejetant les frames tronquées.
+    """
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+    total = 0
+    while True:
+        chunk = reader.read(min(1024 * 1024, max_size + 1 - total))
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise ValueError(f"Decompressed body exceeds {max_size} bytes")
+
+    chunks = []
+    while data:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        chunks.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise ValueError("Truncated zstd body")
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresse un body en gzip ou zstd."""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+async def run_sized(func: Callable[..., bytes], data: bytes, *args) -> bytes:
+    """
+    Exécute une (dé)compression, dans le pool d'offload si le body est gros.
+
+    zlib et zstandard relâchent le GIL: les gros bodies ne bloquent pas
+    l'event loop, les petits évitent le coût du passage au thread pool.
+    """
+    if len(data) >= get_config().compression_offload_min_size:
+        return await run_in_pool(func, data, *args)
+    return func(data, *args)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Choisit l'encodage de réponse à partir du header Accept-Encoding."""
+    if not accept_encoding:
+        return None
+
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        # Ignorer les encodages explicitement refusés (q=0)
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+
+    for encoding in supported_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+async def compressed_json_response(
+    content: Any,
+    accept_encoding: Optional[str],
+    status_code: int = 200
+) -> Response:
+    """
+    Construit une réponse JSON, compressée si le client l'accepte et si le
+    body dépasse RESPONSE_COMPRESSION_MIN_SIZE.
+    """
+    config = get_config()
+    # Même rendu que JSONResponse
+    body = json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+    headers: Dict[str, str] = {"Vary": "Accept-Encoding"}
+
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding and config.response_compression and len(body) >= config.response_compression_min_size:
+        body = await run_sized(compress, body, encoding)
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+class DecompressedRequest(Request):
+    """
+    Request dont le body est décodé selon son Content-Encoding, et dont le
+    JSON des gros bodies est parsé hors de l'event loop.
+    """
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_decoded_body"):
+            body = await super().body()
+            encoding = self.headers.get("content-encoding", "identity").strip().lower()
+
+            if encoding != "identity" and body:
+                try:
+                    body = await run_sized(decompress, body, encoding, get_config().max_request_body_size)
+                except UnsupportedEncodingError as e:
+                    raise HTTPException(status_code=415, detail=str(e))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+
+            self._decoded_body = body
+        return self._decoded_body
+
+    async def json(self) -> Any:
+        # Parsing des gros bodies dans le pool d'offload (OFFLOAD_MIN_SIZE)
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            self._json = await run_cpu(len(body), json.loads, body)
+        return self._json
+
+
+class DecompressingRoute(APIRoute):
+    """Route FastAPI acceptant les bodies gzip / zstd (Content-Encoding)."""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            return await original_handler(DecompressedRequest(request.scope, request.receive))
+
+        return handler
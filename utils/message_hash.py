@@ -0,0 +1,56 @@
+import hashlib
+import json
+from typing import List, Dict, Any
+
+
+def _canonical_block(block: Any) -> Any:
+    """Réduit un content block aux champs qui définissent la conversation."""
+    if not isinstance(block, dict):
+        return block
+
+    # Les champs None (ex: title absent) et cache_control ne changent pas le contenu
+    return {
+        k: v for k, v in block.items()
+        if v is not None and k != "cache_control"
+    }
+
+
+def canonical_message(message: Dict[str, Any]) -> bytes:
+    """
+    Sérialise un message Anthropic sous une forme canonique.
+
+    Un content string et une liste d'un seul block texte sont équivalents,
+    pour que le message assistant renvoyé par le client corresponde au
+    message enregistré par le proxy.
+    """
+    content = message.get("content")
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    elif isinstance(content, list):
+        content = [_canonical_block(b) for b in content]
+
+    return json.dumps(
+        {"role": message.get("role"), "content": content},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    ).encode("utf-8")
+
+
+def extend_hash(prefix_hash: str, message: Dict[str, Any]) -> str:
+    """Hash d'un préfixe de conversation prolongé d'un message."""
+    h = hashlib.sha256(prefix_hash.encode("ascii"))
+    h.update(hashlib.sha256(canonical_message(message)).digest())
+    return h.hexdigest()
+
+
+def prefix_hashes(messages: List[Dict[str, Any]], seed: str = "") -> List[str]:
+    """
+    Calcule les hashes chaînés de tous les préfixes d'une conversation.
+
+    hashes[k] identifie messages[:k]; hashes[0] ne dépend que du seed.
+    """
+    hashes = [hashlib.sha256(seed.encode("utf-8")).hexdigest()]
+    for message in messages:
+        hashes.append(extend_hash(hashes[-1], message))
+    return hashes
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Any, Dict, Optional
+
+from config import get_config
+from utils.logging import logger
+from utils.profiling import profiler
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_config().offload_workers, thread_name_prefix="offload"
+        )
+    return _executor
+
+
+async def run_cpu(size: int, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Exécute une conversion / (dé)sérialisation, dans le pool borné si size
+    (octets traités) dépasse OFFLOAD_MIN_SIZE.
+
+    Le code Python garde le GIL, mais l'interpréteur le rend toutes les
+    sys.getswitchinterval() (5 ms): l'event loop continue à livrer les
+    tokens des autres streams au lieu d'être bloqué toute la conversion.
+    Les petites requêtes restent sur l'event loop (pas de coût de thread).
+    """
+    if size < get_config().offload_min_size:
+        return func(*args, **kwargs)
+    return await run_in_pool(func, *args, **kwargs)
+
+
+async def run_in_pool(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Exécute func dans le pool borné (OFFLOAD_WORKERS threads)."""
+    loop = asyncio.get_running_loop()
+    call = profiler.profile_offload(partial(func, *args, **kwargs))
+    return await loop.run_in_executor(_get_executor(), call)
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class LoopLagMonitor:
+    """
+    Mesure le retard de l'event loop: une task dort interval_ms et mesure
+    le temps réellement écoulé en plus. Un retard élevé signifie qu'un
+    traitement synchrone bloque la livraison des streams.
+    """
+
+    def __init__(self, interval_ms: float = 50.0, window: int = 1200):
+        self.interval = interval_ms / 1000
+        self._lags = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - start - self.interval) * 1000)
+            self._lags.append(lag_ms)
+            if lag_ms > 100:
+                logger.warning(f"Event loop lag: {lag_ms:.0f} ms")
+
+    def stats(self) -> Dict[str, float]:
+        """Retard de l'event loop en ms sur la fenêtre récente (~1 min)."""
+        lags = sorted(self._lags)
+        if not lags:
+            return {"last": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "last": round(self._lags[-1], 2),
+            "p50": round(lags[len(lags) // 2], 2),
+            "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 2),
+            "max": round(lags[-1], 2),
+        }
+
+
+loop_lag = LoopLagMonitor()
@@ -0,0 +1,367 @@
+import contextvars
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import partial
+from typing import Optional, AsyncIterator, Awaitable, Any, Callable, Dict, Set, Tuple
+
+from pydantic import BaseModel, Field
+
+from utils.logging import logger
+
+
+# Marque les requêtes sélectionnées pour le profiling (héritée par les tasks filles)
+_profiled_request: contextvars.ContextVar[bool] = contextvars.ContextVar("profiled_request", default=False)
+
+
+class ProfileSettings(BaseModel):
+    """Paramètres d'une session de profiling (POST /admin/profile)."""
+    duration_s: float = Field(default=30.0, gt=0, le=3600)
+    sample_rate: float = Field(default=1.0, gt=0, le=1)
+    interval_ms: float = Field(default=5.0, ge=1, le=1000)
+    tracemalloc: bool = False
+    # Au plus une fenêtre d'allocations (2 snapshots) toutes les N secondes
+    allocation_interval_s: float = Field(default=5.0, ge=0.5, le=3600)
+
+
+def _frame_name(frame) -> str:
+    """Nom d'une frame au format py-spy: fonction (fichier:ligne)."""
+    code = frame.f_code
+    # co_qualname n'existe qu'à partir de Python 3.11
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Profiler par échantillonnage des requêtes /v1/messages.
+
+    Un thread échantillonne la pile de l'event loop toutes les interval_ms,
+    ainsi que celle des threads d'offload qui exécutent une conversion d'une
+    requête profilée (racine `request;offload`). Seules les piles qui
+    traversent un wrapper de requête profilée (conversion, génération SSE)
+    sont gardées. Les attentes I/O amont sont mesurées en temps réel et
+    ajoutées sous la pile `upstream_wait`.
+
+    Le résultat est au format "folded stacks" (flamegraph.pl, speedscope).
+    Hors session, seul l'attribut `active` est lu sur le hot path.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.settings: Optional[ProfileSettings] = None
+        self.started_at: Optional[float] = None
+        self.until: Optional[float] = None
+        self.profiled_requests = 0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        # Attentes amont en secondes, converties en échantillons à l'export
+        self._waits: Counter = Counter()
+        self._allocations: Counter = Counter()
+        self.allocation_peak = 0
+        self.allocation_windows = 0
+        self.allocation_windows_skipped = 0
+        self._window_open = False
+        self._next_window = 0.0
+        # Un seul worker calcule les diffs de snapshots, une fenêtre à la fois
+        self._diffs: "queue.Queue[Tuple[str, tracemalloc.Snapshot, tracemalloc.Snapshot]]" = queue.Queue(maxsize=1)
+        self._diff_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._markers = {
+            SamplingProfiler.profile_call.__code__: "request",
+            SamplingProfiler._profiled_stream.__code__: "stream",
+            SamplingProfiler._profiled_offload.__code__: "request;offload",
+        }
+        # Threads du pool d'offload exécutant une conversion d'une requête profilée
+        self._offload_threads: Set[int] = set()
+        # Surcoût propre au profiler, exclu des échantillons CPU
+        self._ignored = {
+            SamplingProfiler._begin_allocations.__code__,
+            SamplingProfiler._end_allocations.__code__,
+        }
+
+    def start(self, settings: ProfileSettings) -> None:
+        """Démarre une session depuis l'event loop (thread à échantillonner)."""
+        if self.active:
+            raise RuntimeError("A profiling session is already running")
+
+        self.settings = settings
+        self.started_at = time.time()
+        self.until = time.monotonic() + settings.duration_s
+        self.profiled_requests = 0
+        self.samples = 0
+        self._stacks = Counter()
+        self._waits = Counter()
+        self._allocations = Counter()
+        self.allocation_peak = 0
+        self.allocation_windows = 0
+        self.allocation_windows_skipped = 0
+        self._window_open = False
+        self._next_window = 0.0
+        self._stop.clear()
+
+        if settings.tracemalloc:
+            tracemalloc.start(25)
+            if self._diff_thread is None:
+                self._diff_thread = threading.Thread(
+                    target=self._diff_worker, name="profiler-allocations", daemon=True
+                )
+                self._diff_thread.start()
+
+        loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, args=(loop_thread_id,), name="sampling-profiler", daemon=True
+        )
+        self.active = True
+        self._thread.start()
+        logger.info(f"Profiling started: {settings.model_dump()}")
+
+    def stop(self) -> None:
+        """Arrête la session en cours (sans attendre la fin de la fenêtre)."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def _run(self, loop_thread_id: int) -> None:
+        settings = self.settings
+        interval = settings.interval_ms / 1000
+
+        try:
+            while not self._stop.wait(interval) and time.monotonic() < self.until:
+                frames = sys._current_frames()
+                for thread_id in (loop_thread_id, *tuple(self._offload_threads)):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self._sample(frame)
+        except Exception:
+            logger.exception("Profiling sampler failed")
+        finally:
+            # Nettoyer avant de libérer la place pour une nouvelle session
+            if settings.tracemalloc and tracemalloc.is_tracing():
+                # Pic de mémoire tracée sur toute la session
+                self.allocation_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.active = False
+            logger.info(f"Profiling stopped: {self.samples} samples, {self.profiled_requests} requests")
+
+    def _sample(self, frame) -> None:
+        """Garde la pile si elle appartient à une requête profilée."""
+        names = []
+        root = None
+        while frame is not None:
+            root = self._markers.get(frame.f_code)
+            if root:
+                break
+            if frame.f_code in self._ignored:
+                return
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+
+        if root is None:
+            return
+
+        names.append(root)
+        stack = ";".join(reversed(names))
+        with self._lock:
+            self._stacks[stack] += 1
+            self.samples += 1
+
+    def _begin_allocations(self) -> Optional[tracemalloc.Snapshot]:
+        """
+        Snapshot tracemalloc au début d'une fenêtre profilée.
+
+        take_snapshot bloque l'event loop (proportionnel au nombre de
+        traces): au plus une fenêtre est ouverte à la fois, toutes les
+        allocation_interval_s, et seulement si le worker de diff est libre.
+        """
+        if not (self.active and self.settings.tracemalloc and tracemalloc.is_tracing()):
+            return None
+        now = time.monotonic()
+        if self._window_open or now < self._next_window or self._diffs.full():
+            self.allocation_windows_skipped += 1
+            return None
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        except RuntimeError:  # session arrêtée entre-temps
+            return None
+        self._window_open = True
+        self._next_window = now + self.settings.allocation_interval_s
+        return snapshot
+
+    def _end_allocations(self, root: str, before: Optional[tracemalloc.Snapshot]) -> None:
+        """
+        Envoie au worker le diff des snapshots de début et de fin de fenêtre:
+        allocations faites pendant la fenêtre et encore vivantes à sa fin.
+
+        tracemalloc trace tout le process: les requêtes concurrentes
+        apparaissent aussi dans le diff.
+        """
+        if before is None:
+            return
+        self._window_open = False
+        if not tracemalloc.is_tracing():
+            return
+        try:
+            after = tracemalloc.take_snapshot()
+            self._diffs.put_nowait((root, before, after))
+        except (RuntimeError, queue.Full):
+            self.allocation_windows_skipped += 1
+
+    def _diff_worker(self) -> None:
+        # Le diff (Python pur, plusieurs centaines de ms) est calculé hors de l'event loop
+        ignored = (tracemalloc.__file__, __file__)
+        while True:
+            root, before, after = self._diffs.get()
+            try:
+                diff = after.compare_to(before, "traceback")
+            except Exception:
+                logger.exception("Allocation diff failed")
+                continue
+            finally:
+                del before, after
+
+            with self._lock:
+                self.allocation_windows += 1
+                for stat in diff:
+                    if stat.size_diff <= 0 or any(f.filename in ignored for f in stat.traceback):
+                        continue
+                    # Frames triées de la plus ancienne à la plus récente, comme les folded stacks
+                    frames = [f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback]
+                    self._allocations[";".join([root] + frames)] += stat.size_diff
+            del diff
+
+    def sample_request(self) -> bool:
+        """Sélectionne (ou non) la requête courante selon sample_rate."""
+        if not self.active or random.random() >= self.settings.sample_rate:
+            return False
+        _profiled_request.set(True)
+        self.profiled_requests += 1
+        return True
+
+    async def profile_call(self, awaitable: Awaitable[Any]) -> Any:
+        """Exécute le traitement d'une requête sous le marqueur `request`."""
+        allocations = self._begin_allocations()
+        try:
+            return await awaitable
+        finally:
+            self._end_allocations("request", allocations)
+
+    async def _profiled_stream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        allocations = self._begin_allocations()
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+            self._end_allocations("stream", allocations)
+
+    def _profiled_offload(self, func: Callable[[], Any]) -> Any:
+        thread_id = threading.get_ident()
+        self._offload_threads.add(thread_id)
+        try:
+            return func()
+        finally:
+            self._offload_threads.discard(thread_id)
+
+    def profile_offload(self, func: Callable[[], Any]) -> Callable[[], Any]:
+        """Rend échantillonnable une fonction de la requête profilée exécutée dans le pool d'offload."""
+        if not (self.active and _profiled_request.get()):
+            return func
+        return partial(self._profiled_offload, func)
+
+    def profile_stream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Place l'encodage SSE d'une requête profilée sous le marqueur `stream`."""
+        if not _profiled_request.get():
+            return stream
+        return self._profiled_stream(stream)
+
+    async def _timed_upstream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    line = await iterator.__anext__()
+                except StopAsyncIteration:
+                    self._add_wait("upstream_wait;stream", time.perf_counter() - start)
+                    return
+                self._add_wait("upstream_wait;stream", time.perf_counter() - start)
+                yield line
+        finally:
+            # Fermer le stream amont si le consommateur s'arrête avant la fin
+            await stream.aclose()
+
+    def time_upstream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Mesure les attentes sur le stream amont d'une requête profilée."""
+        if not _profiled_request.get():
+            return stream
+        return self._timed_upstream(stream)
+
+    async def _timed_call(self, awaitable: Awaitable[Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self._add_wait("upstream_wait;call", time.perf_counter() - start)
+
+    def time_upstream_call(self, awaitable: Awaitable[Any]) -> Awaitable[Any]:
+        """Mesure la durée d'un appel amont non-streaming (temps réel)."""
+        if not _profiled_request.get():
+            return awaitable
+        return self._timed_call(awaitable)
+
+    def _add_wait(self, stack: str, seconds: float) -> None:
+        """Ajoute une attente I/O (secondes, converties en échantillons à l'export)."""
+        if not self.active:
+            return
+        with self._lock:
+            self._waits[stack] += seconds
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "settings": self.settings.model_dump() if self.settings else None,
+            "started_at": self.started_at,
+            "remaining_s": max(0.0, self.until - time.monotonic()) if self.active else 0.0,
+            "profiled_requests": self.profiled_requests,
+            "samples": self.samples,
+            "allocation_stacks": len(self._allocations),
+            "allocation_windows": self.allocation_windows,
+            "allocation_windows_skipped": self.allocation_windows_skipped,
+            "allocation_peak_bytes": self._allocation_peak(),
+        }
+
+    def _allocation_peak(self) -> int:
+        """Pic de mémoire tracée depuis le début de la session (en octets)."""
+        if self.active and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        return self.allocation_peak
+
+    def folded_cpu(self) -> str:
+        """Piles échantillonnées au format folded (une pile et un compte par ligne)."""
+        with self._lock:
+            stacks = Counter(self._stacks)
+            interval = self.settings.interval_ms if self.settings else 1.0
+            for stack, seconds in self._waits.items():
+                samples = round(seconds * 1000 / interval)
+                if samples:
+                    stacks[stack] += samples
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def folded_allocations(self) -> str:
+        """
+        Allocations faites par les requêtes profilées et encore vivantes à la
+        fin de leur fenêtre, en octets, au format folded.
+        """
+        with self._lock:
+            return "".join(f"{stack} {size}\n" for stack, size in self._allocations.most_common())
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,321 @@
+import contextvars
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable
+
+import httpx
+
+from utils.logging import logger
+
+
+# Sanitization par chemin: un spec décrit les champs structurels d'un objet.
+#   KEEP          valeur gardée telle quelle (sous-arbre compris)
+#   frozenset     chaîne gardée seulement si elle fait partie des valeurs connues
+#   dict          clés connues → spec, toute autre clé est du payload
+#   Values(spec)  objet dont chaque valeur suit spec (ex: properties d'un schéma)
+#   None          payload: chaque chaîne devient {"$r": longueur}
+# Un spec s'applique à chaque élément des listes. Les nombres et booléens
+# sont gardés, les clés des objets aussi (forme nécessaire au replay).
+KEEP = True
+
+
+class Values:
+    """Spec d'un objet dont les clés sont libres et les valeurs suivent spec."""
+
+    def __init__(self, spec: Any):
+        self.spec = spec
+
+
+# JSON Schema des tools: structure gardée (type, noms des propriétés,
+# required, items...), description / enum / default / examples sont du payload
+SCHEMA_SPEC: Dict[str, Any] = {"type": KEEP, "required": KEEP, "format": KEEP, "$ref": KEEP}
+SCHEMA_SPEC.update({
+    "properties": Values(SCHEMA_SPEC),
+    "$defs": Values(SCHEMA_SPEC),
+    "definitions": Values(SCHEMA_SPEC),
+    "items": SCHEMA_SPEC,
+    "prefixItems": SCHEMA_SPEC,
+    "additionalProperties": SCHEMA_SPEC,
+    "anyOf": SCHEMA_SPEC,
+    "oneOf": SCHEMA_SPEC,
+    "allOf": SCHEMA_SPEC,
+    "not": SCHEMA_SPEC,
+})
+
+_BLOCK_TYPES = frozenset({
+    "text", "image", "document", "tool_use", "tool_result", "thinking", "redacted_thinking",
+})
+_CACHE_CONTROL = {"type": KEEP}
+_SOURCE = {"type": frozenset({"base64", "url", "text"}), "media_type": KEEP}
+# Blocks imbriqués (contenu des tool_result, system): seul le type est gardé
+_INNER_BLOCK = {"type": _BLOCK_TYPES, "source": _SOURCE, "cache_control": _CACHE_CONTROL}
+_BLOCK = {
+    "type": _BLOCK_TYPES,
+    "id": KEEP,
+    "tool_use_id": KEEP,
+    "name": KEEP,
+    "source": _SOURCE,
+    "cache_control": _CACHE_CONTROL,
+    "content": _INNER_BLOCK,
+}
+# Requête Anthropic entrante: tool_use.input, textes, system... sont du payload
+REQUEST_SPEC = {
+    "model": KEEP,
+    "messages": {"role": KEEP, "content": _BLOCK},
+    "system": _INNER_BLOCK,
+    "tools": {"type": KEEP, "name": KEEP, "input_schema": SCHEMA_SPEC, "cache_control": _CACHE_CONTROL},
+    "tool_choice": {"type": KEEP, "name": KEEP},
+}
+
+_OPENAI_MESSAGE = {
+    "role": KEEP,
+    "tool_calls": {"id": KEEP, "type": KEEP, "function": {"name": KEEP}},
+}
+_RESPONSES_ITEM = {
+    "type": KEEP,
+    "id": KEEP,
+    "call_id": KEEP,
+    "name": KEEP,
+    "role": KEEP,
+    "status": KEEP,
+    "content": {"type": KEEP},
+}
+_RESPONSES_OBJECT = {
+    "id": KEEP,
+    "object": KEEP,
+    "model": KEEP,
+    "status": KEEP,
+    "output": _RESPONSES_ITEM,
+    "usage": KEEP,
+    "incomplete_details": KEEP,
+}
+# Réponses et chunks amont (Chat Completions et Responses API)
+UPSTREAM_SPEC = {
+    "id": KEEP,
+    "object": KEEP,
+    "model": KEEP,
+    "system_fingerprint": KEEP,
+    "choices": {"finish_reason": KEEP, "message": _OPENAI_MESSAGE, "delta": _OPENAI_MESSAGE},
+    "usage": KEEP,
+    # Responses API
+    "type": KEEP,
+    "status": KEEP,
+    "item_id": KEEP,
+    "output": _RESPONSES_ITEM,
+    "item": _RESPONSES_ITEM,
+    "part": {"type": KEEP},
+    "response": _RESPONSES_OBJECT,
+    "incomplete_details": KEEP,
+}
+
+# Enregistrement de la requête courante (None si non enregistrée)
+_current_record: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "current_record", default=None
+)
+
+
+def sanitize(value: Any, spec: Any = None) -> Any:
+    """
+    Retire le contenu d'une requête / réponse en gardant sa forme.
+
+    Seuls les champs décrits par spec (REQUEST_SPEC, UPSTREAM_SPEC) sont
+    gardés; toute autre chaîne (textes, base64, arguments, input des
+    tool_use...) devient {"$r": longueur}: la taille des payloads est
+    conservée pour le replay sans enregistrer leur contenu.
+    """
+    if spec is KEEP:
+        return value
+    if isinstance(value, dict):
+        if isinstance(spec, Values):
+            return {k: sanitize(v, spec.spec) for k, v in value.items()}
+        fields = spec if isinstance(spec, dict) else {}
+        return {k: sanitize(v, fields.get(k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, spec) for v in value]
+    if isinstance(value, str):
+        if isinstance(spec, frozenset) and value in spec:
+            return value
+        return {"$r": len(value)}
+    return value
+
+
+def expand(value: Any, filler: str = "x") -> Any:
+    """Inverse de sanitize pour le replay: {"$r": n} devient une chaîne de n caractères."""
+    if isinstance(value, dict):
+        if len(value) == 1 and "$r" in value:
+            return filler * value["$r"]
+        return {k: expand(v, filler) for k, v in value.items()}
+    if isinstance(value, list):
+        return [expand(v, filler) for v in value]
+    return value
+
+
+def _sanitize_line(line: str) -> Any:
+    """Sanitize une ligne SSE amont ("data: {...}" → objet JSON sanitizé)."""
+    if line.startswith("data: ") and line[6:].strip() != "[DONE]":
+        try:
+            return {"data": sanitize(json.loads(line[6:]), UPSTREAM_SPEC)}
+        except json.JSONDecodeError:
+            return {"data": {"$r": len(line) - 6}}
+    return line
+
+
+class TrafficRecorder:
+    """
+    Enregistre le trafic /v1/messages dans un fichier JSONL rotatif.
+
+    Chaque ligne contient la requête entrante et le timing de la réponse
+    amont (chunks de streaming avec leur offset en ms), sanitizés. La
+    sanitization et l'écriture sont faites par un thread dédié: l'event
+    loop ne fait qu'empiler des références. La file est bornée (les
+    records gardent les bodies complets): si le thread prend du retard,
+    les nouveaux records sont abandonnés et comptés dans `dropped`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._handler: Optional[RotatingFileHandler] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def open(self, path: str, max_bytes: int, backup_count: int, queue_size: int = 64) -> None:
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._handler = RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+        self.enabled = True
+        logger.info(f"Recording traffic to {path}")
+
+    def close(self) -> None:
+        """Vide la file d'attente et ferme le fichier."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._handler.close()
+        if self.dropped:
+            logger.warning(f"Traffic recorder dropped {self.dropped} records")
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            try:
+                line = json.dumps(self._sanitize_record(record), separators=(",", ":"))
+                self._handler.handle(logging.makeLogRecord({"msg": line, "args": None}))
+            except Exception:
+                logger.exception("Failed to write traffic record")
+
+    @staticmethod
+    def _sanitize_record(record: Dict[str, Any]) -> Dict[str, Any]:
+        upstream = record["upstream"]
+        if "chunks" in upstream:
+            upstream["chunks"] = [[offset, _sanitize_line(line)] for offset, line in upstream["chunks"]]
+        if "body" in upstream:
+            upstream["body"] = sanitize(upstream["body"], UPSTREAM_SPEC)
+        record["request"] = sanitize(record["request"], REQUEST_SPEC)
+        return record
+
+    def start(self, body: Any, backend: str, session: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Démarre l'enregistrement de la requête courante (body JSON déjà parsé).
+
+        session ({"id", "delta"}) indique une requête en mode session, dont
+        le body ne porte que les nouveaux messages si delta est vrai.
+        """
+        _current_record.set({
+            "v": 1,
+            "ts": time.time(),
+            "backend": backend,
+            "session": session,
+            "request": body,
+            "upstream": {},
+        })
+
+    def _finish(
+        self, record: Dict[str, Any], start: float, error: Optional[BaseException], completed: bool
+    ) -> None:
+        """
+        Termine l'enregistrement. Une réponse interrompue sans erreur
+        (déconnexion du client, annulation) est marquée "aborted": le
+        replay coupe la requête au même moment au lieu de la rejouer comme
+        une réponse complète plus courte.
+        """
+        upstream = record["upstream"]
+        upstream["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        upstream["status"] = 200
+        if not completed and error is None:
+            upstream["aborted"] = True
+        if isinstance(error, httpx.HTTPStatusError):
+            upstream["status"] = error.response.status_code
+        elif error is not None:
+            upstream["status"] = 0
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(f"Traffic recorder queue full, {self.dropped} records dropped")
+
+    async def _recorded_stream(self, record: Dict[str, Any], stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        chunks = record["upstream"]["chunks"] = []
+        start = time.perf_counter()
+        error = None
+        completed = False
+        try:
+            async for line in stream:
+                if line:
+                    chunks.append((round((time.perf_counter() - start) * 1000, 2), line))
+                yield line
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # GeneratorExit / CancelledError: completed reste faux
+            self._finish(record, start, error, completed)
+            # Fermer le stream amont (connexion httpx) si le consommateur s'arrête avant la fin
+            await stream.aclose()
+
+    def record_stream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Enregistre les lignes du stream amont et leur offset."""
+        record = _current_record.get()
+        if record is None:
+            return stream
+        return self._recorded_stream(record, stream)
+
+    async def _recorded_call(self, record: Dict[str, Any], awaitable: Awaitable[Dict[str, Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        error = None
+        completed = False
+        try:
+            result = await awaitable
+            record["upstream"]["body"] = result
+            completed = True
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish(record, start, error, completed)
+
+    def record_call(self, awaitable: Awaitable[Dict[str, Any]]) -> Awaitable[Dict[str, Any]]:
+        """Enregistre la réponse amont non-streaming et sa durée."""
+        record = _current_record.get()
+        if record is None:
+            return awaitable
+        return self._recorded_call(record, awaitable)
+
+
+recorder = TrafficRecorder()